@@ -0,0 +1,256 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import lsb_basic
+import lsb_substitution
+from utils.algorithms import optimal_pixel_adj
+from utils.binary import bits2bytes, bytes2bits
+from utils.compression import deflate
+from utils.indices import permute_indices
+import utils.kernels as ukernels
+from utils.stats import Metrics, psnr
+
+
+SIZES = (512, 2048)
+QUICK_SIZES = (256,)
+# Fraction of the cover capacity filled by the secret
+FILL = 0.5
+
+def synthetic_image(size, channels=3, seed=0):
+    """Square image of smooth gradients with noise, which compresses like a photo."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:size, :size]
+    base = (x + y) * 255 / (2 * size - 2 or 1)
+    noise = rng.normal(0, 8, (size, size, channels))
+    image = np.clip(base[...,None] + noise, 0, 255).astype(np.uint8)
+    return image[...,0] if channels == 1 else image
+
+def synthetic_secret(length, seed=0):
+    """Half random and half repetitive bytes, so that compression has some effect."""
+    rng = np.random.default_rng(seed)
+    text = b'Lorem ipsum dolor sit amet, consectetur adipiscing elit. '
+    half = length // 2
+    repeated = (text * (half // len(text) + 1))[:half]
+    return rng.integers(0, 256, length - half, dtype=np.uint8).tobytes() + repeated
+
+def measure(func, repeat=3):
+    """
+    Measure the best wall time of `func` and its peak traced memory.
+
+    The peak memory is measured in a separate run, because tracing slows down
+    the execution. It includes numpy arrays and Python objects, but not the
+    internal buffers of PIL.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return min(times), peak
+
+def record(name, params, elapsed, peak, payload=0, pixels=0):
+    """Benchmark result with the throughput in payload MB/s and megapixels/s."""
+    return {'name': name, 'params': params, 'time': elapsed,
+            'peak_mb': peak / 1e6, 'payload_mb_s': payload / 1e6 / elapsed,
+            'mpixels_s': pixels / 1e6 / elapsed}
+
+def bench_kernels(sizes, repeat=3):
+    """Benchmark the individual kernels for images of each size."""
+    results = []
+    for size in sizes:
+        pixels = size * size
+        cover = synthetic_image(size, channels=1)
+        secret = synthetic_secret(pixels // 8)
+        elapsed, peak = measure(lambda: deflate(secret), repeat)
+        results.append(record('deflate', {'size': size}, elapsed, peak, len(secret)))
+        stego = cover ^ 1
+        elapsed, peak = measure(lambda: psnr(stego, cover), repeat)
+        results.append(record('psnr', {'size': size}, elapsed, peak, pixels=pixels))
+        # The metrics of the embedding only see the modified pixels, e.g., 1%
+        modified = pixels // 100
+        elapsed, peak = measure(lambda: Metrics(pixels).update(cover.reshape(-1)[:modified],
+                                                               stego.reshape(-1)[:modified]),
+                                repeat)
+        results.append(record('metrics', {'size': size}, elapsed, peak, pixels=modified))
+        for passwd in ('', 'passwd'):
+            for length in (pixels // 100, None):
+                func = lambda: permute_indices(cover.shape, passwd, length, cache=None)
+                elapsed, peak = measure(func, repeat)
+                params = {'size': size, 'passwd': bool(passwd), 'length': length or pixels}
+                results.append(record('permute_indices', params, elapsed, peak,
+                                      pixels=length or pixels))
+        # The in-memory pipeline on a single thread and on all the cores
+        data = secret[:int(pixels * 2 // 8 * FILL)]
+        stego = cover.copy()
+        lsb_substitution.embed_array(stego, data, lsb=2, passwd='passwd', compress=False)
+        for workers in sorted({1, os.cpu_count() or 1}):
+            params = {'size': size, 'workers': workers}
+            func = lambda: lsb_substitution.embed_array(cover.copy(), data, lsb=2, passwd='passwd',
+                                                        compress=False, workers=workers)
+            elapsed, peak = measure(func, repeat)
+            results.append(record('embed_array', params, elapsed, peak, len(data), pixels))
+            func = lambda: lsb_substitution.extract_array(stego, 'passwd', workers=workers)
+            elapsed, peak = measure(func, repeat)
+            results.append(record('extract_array', params, elapsed, peak, len(data), pixels))
+        for lsb in range(1, 9):
+            data = secret[:pixels * lsb // 8]
+            bits = bytes2bits(data, lsb)
+            elapsed, peak = measure(lambda: bytes2bits(data, lsb), repeat)
+            results.append(record('bytes2bits', {'size': size, 'lsb': lsb}, elapsed, peak,
+                                  len(data)))
+            elapsed, peak = measure(lambda: bits2bytes(bits, lsb), repeat)
+            results.append(record('bits2bytes', {'size': size, 'lsb': lsb}, elapsed, peak,
+                                  len(data)))
+            original = cover.reshape(-1)[:len(bits)]
+            modified = (original & (256 - 2**lsb)) | bits
+            elapsed, peak = measure(lambda: optimal_pixel_adj(modified, original, lsb), repeat)
+            results.append(record('optimal_pixel_adj', {'size': size, 'lsb': lsb}, elapsed, peak,
+                                  pixels=len(bits)))
+    return results
+
+def bench_pipeline(sizes, repeat=3, fmt='png', folder='.'):
+    """Benchmark embedding and extraction end-to-end, including image I/O."""
+    results = []
+    for size in sizes:
+        pixels = size * size
+        cover_file = os.path.join(folder, f'cover_{size}.{fmt}')
+        Image.fromarray(synthetic_image(size)).save(cover_file)
+        for lsb, passwd, compress in itertools.product(range(1, 9), ('', 'passwd'), (False, True)):
+            secret_file = os.path.join(folder, f'secret_{size}_{lsb}.bin')
+            secret = synthetic_secret(int(pixels * lsb // 8 * FILL))
+            with open(secret_file, 'wb') as f:
+                f.write(secret)
+            stego_file = os.path.join(folder, f'stego_{size}.{fmt}')
+            params = {'size': size, 'lsb': lsb, 'passwd': bool(passwd), 'compress': compress,
+                      'format': fmt}
+            func = lambda: lsb_substitution.embed(cover_file, secret_file, stego_file, lsb,
+                                                  passwd, compress)
+            elapsed, peak = measure(func, repeat)
+            results.append(record('lsb_substitution.embed', params, elapsed, peak,
+                                  len(secret), pixels))
+            func = lambda: lsb_substitution.extract(stego_file, passwd, folder)
+            elapsed, peak = measure(func, repeat)
+            results.append(record('lsb_substitution.extract', params, elapsed, peak,
+                                  len(secret), pixels))
+        secret_file = os.path.join(folder, f'secret_{size}.txt')
+        secret = synthetic_secret(int(pixels // 8 * FILL) - 8)
+        with open(secret_file, 'wb') as f:
+            f.write(secret)
+        stego_file = os.path.join(folder, f'basic_{size}.{fmt}')
+        params = {'size': size, 'format': fmt}
+        func = lambda: lsb_basic.embed(cover_file, secret_file, stego_file)
+        elapsed, peak = measure(func, repeat)
+        results.append(record('lsb_basic.embed', params, elapsed, peak, len(secret), pixels))
+        func = lambda: lsb_basic.extract(stego_file)
+        elapsed, peak = measure(func, repeat)
+        results.append(record('lsb_basic.extract', params, elapsed, peak, len(secret), pixels))
+    return results
+
+def run(sizes=SIZES, repeat=3, fmt='png', kernels=True, pipeline=True):
+    """
+    Run the benchmark suite on synthetic data.
+
+    Returns
+    -------
+    out : dict
+        - 'meta': The Python, numpy and PIL versions, the kernel backend, the
+                  number of CPUs and the platform.
+        - 'results': List of results. Each has the benchmark 'name', its
+                     'params', the best wall 'time' in seconds, 'peak_mb' of
+                     traced memory, and the throughput in 'payload_mb_s' and
+                     'mpixels_s', where applicable.
+    """
+    results = []
+    if kernels:
+        results += bench_kernels(sizes, repeat)
+    if pipeline:
+        with tempfile.TemporaryDirectory() as folder:
+            results += bench_pipeline(sizes, repeat, fmt, folder)
+    meta = {'python': platform.python_version(), 'numpy': np.__version__,
+            'pillow': Image.__version__, 'backend': ukernels.backend, 'cpus': os.cpu_count(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+def compare(old, new):
+    """
+    Compare the results of two runs of the benchmark suite.
+
+    Returns
+    -------
+    out : list of tuple
+        (name, params, old time, new time, speedup, old peak, new peak) for
+        each benchmark present in both runs.
+    """
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    old = {key(r): r for r in old['results']}
+    rows = []
+    for r in new['results']:
+        o = old.get(key(r))
+        if o is not None:
+            rows.append((r['name'], r['params'], o['time'], r['time'], o['time'] / r['time'],
+                         o['peak_mb'], r['peak_mb']))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the LSB steganography hot paths.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument('-o', '--output', default='benchmark.json',
+                            help='JSON file for the results')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                            help='side lengths of the square synthetic covers')
+    run_parser.add_argument('--quick', action='store_true',
+                            help=f'use small covers of size {QUICK_SIZES} and 1 repeat')
+    run_parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    run_parser.add_argument('--format', default='png', help='image format of the covers')
+    run_parser.add_argument('--only', choices=('kernels', 'pipeline'),
+                            help='run only the kernels or the end-to-end benchmarks')
+    run_parser.add_argument('--backend', choices=ukernels.BACKENDS, default=ukernels.backend,
+                            help=f'backend of the kernels (default: {ukernels.backend})')
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        sizes = QUICK_SIZES if args.quick else args.sizes
+        repeat = 1 if args.quick else args.repeat
+        with ukernels.use(args.backend):
+            out = run(sizes, repeat, args.format, args.only != 'pipeline', args.only != 'kernels')
+        with open(args.output, 'w') as f:
+            json.dump(out, f, indent=1)
+        for r in out['results']:
+            print(f"{r['name']:<26} {json.dumps(r['params']):<78} {r['time']*1e3:9.2f} ms "
+                  f"{r['peak_mb']:8.1f} MB")
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = 0
+        for name, params, t0, t1, speedup, m0, m1 in compare(old, new):
+            flag = ' <' if speedup < 1 - args.threshold else ''
+            regressions += bool(flag)
+            print(f'{name:<26} {json.dumps(params):<78} {t0*1e3:9.2f} -> {t1*1e3:9.2f} ms '
+                  f'x{speedup:5.2f} {m0:8.1f} -> {m1:8.1f} MB{flag}')
+        print(f'{regressions} regressions')
@@ -0,0 +1,180 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import glob
+import json
+import os.path
+import time
+
+import lsb_substitution
+from utils.profiling import Profile
+
+
+# Embedding and extraction don't print anything unless a job sets "verbose"
+OPERATIONS = {'embed': functools.partial(lsb_substitution.embed, verbose=False),
+              'extract': functools.partial(lsb_substitution.extract, verbose=False),
+              'update': functools.partial(lsb_substitution.update, verbose=False),
+              'probe': lsb_substitution.probe}
+
+def read_manifest(fname):
+    """
+    Read a manifest of jobs from a JSON lines file.
+
+    Each line is an object with the keyword arguments of `lsb_substitution`
+    embed, extract, update or probe, e.g., "cover_file", "secret_file",
+    "out_file", "lsb", "passwd" and "compress" for embedding. The optional
+    "op" key selects the operation and defaults to "embed". Blank lines are
+    skipped.
+    """
+    with open(fname) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run_job(job):
+    """
+    Run a single job and report its outcome instead of raising.
+
+    Returns
+    -------
+    out : dict
+        - 'job': The position of the job in the manifest (added by `run`).
+        - 'op': The operation of the job.
+        - 'ok': Whether the job completed successfully.
+        - 'error': The error message if the job failed, otherwise None.
+        - 'elapsed': Wall time of the job in seconds.
+        - 'profile': The time and bytes processed by each stage of the job,
+                     as described in `utils.profiling.Profile`.
+        - 'result': The return value of the operation, e.g., the header of a
+                    probe, or None if the job failed.
+    """
+    job = dict(job)
+    op = job.pop('op', 'embed')
+    profile = Profile()
+    start = time.perf_counter()
+    try:
+        result, error = OPERATIONS[op](profile=profile, **job), None
+    except Exception as e:
+        result, error = None, f'{type(e).__name__}: {e}'
+    elapsed = time.perf_counter() - start
+    return {'op': op, 'ok': error is None, 'error': error, 'elapsed': elapsed,
+            'profile': profile.as_dict(), 'result': result}
+
+def run(jobs, workers=None, chunksize=1):
+    """
+    Run embed, extract, update and probe jobs on a process pool.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        The jobs as described in `read_manifest`.
+    workers : None or int, optional
+        Number of worker processes. If not defined, it will be the number of
+        CPUs. Default is None.
+    chunksize : int, optional
+        Number of jobs sent to a worker at a time. Larger values reduce the
+        communication overhead for many small jobs. Default is 1.
+
+    Returns
+    -------
+    out : list of dict
+        The outcome of each job as described in `run_job`, in the same order
+        as `jobs`. A failed job does not affect the rest.
+
+    Notes
+    -----
+    Jobs run concurrently in no particular order, so a job must not depend on
+    the output of another job of the same run.
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(run_job, jobs, chunksize=chunksize)
+        return [dict(r, job=i) for i, r in enumerate(results)]
+
+
+def probe_file(fname, passwd='', mmap=False, legacy=False):
+    """
+    Probe the header of a single file and report its outcome instead of
+    raising.
+
+    Returns
+    -------
+    out : dict
+        - 'file': The path of the file.
+        - 'ok': Whether the file could be probed, e.g., it is a valid image.
+        - 'error': The error message if probing failed, otherwise None.
+        - 'header': The output of `lsb_substitution.probe`, or None if probing
+                    failed.
+    """
+    try:
+        header, error = lsb_substitution.probe(fname, passwd, mmap, legacy=legacy), None
+    except Exception as e:
+        header, error = None, f'{type(e).__name__}: {e}'
+    return {'file': fname, 'ok': error is None, 'error': error, 'header': header}
+
+def scan(folder, passwd='', pattern='*', mmap=False, workers=None, chunksize=16, legacy=False):
+    """
+    Probe the headers of all the files in a directory on a process pool.
+
+    Parameters
+    ----------
+    folder : str
+        The directory to sweep. Subdirectories are not included.
+    passwd : str, optional
+        Password to read the headers with. Default is empty string.
+    pattern : str, optional
+        Glob pattern of the filenames to probe, e.g., '*.png'. Default is '*'.
+    mmap : bool, optional
+        Memory-map the files, so that only the pixels of the header are read.
+        All the files must be uncompressed single-frame images, see
+        `lsb_substitution.probe`. Default is False.
+    workers : None or int, optional
+        Number of worker processes. If not defined, it will be the number of
+        CPUs. Default is None.
+    chunksize : int, optional
+        Number of files sent to a worker at a time. Default is 16.
+    legacy : bool, optional
+        Also look for headers of the older 'shuffle' scheme, which permutes
+        all the pixels of each file without a payload. Default is False.
+
+    Returns
+    -------
+    out : list of dict
+        The outcome of each file as described in `probe_file`, sorted by
+        filename.
+    """
+    files = sorted(f for f in glob.glob(os.path.join(folder, pattern)) if os.path.isfile(f))
+    probe = functools.partial(probe_file, passwd=passwd, mmap=mmap, legacy=legacy)
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(probe, files, chunksize=chunksize))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a manifest of LSB substitution jobs.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('manifest', nargs='?', help='JSON lines file with one job per line')
+    source.add_argument('--scan', metavar='DIR',
+                        help='probe the headers of all files in a directory instead')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='number of jobs sent to a worker at a time '
+                             '(default: 1, or 16 for --scan)')
+    parser.add_argument('--passwd', default='', help='password for --scan')
+    parser.add_argument('--pattern', default='*', help='glob pattern of the files for --scan')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map uncompressed images for --scan')
+    parser.add_argument('--legacy', action='store_true',
+                        help='also look for headers of the older shuffle scheme for --scan')
+    args = parser.parse_args()
+
+    if args.scan:
+        results = scan(args.scan, args.passwd, args.pattern, args.mmap, args.workers,
+                       args.chunksize or 16, args.legacy)
+        for result in results:
+            print(json.dumps(result))
+        found = sum(r['ok'] and r['header']['plausible'] for r in results)
+        print(f'{found}/{len(results)} files carry a plausible payload')
+        raise SystemExit
+
+    results = run(read_manifest(args.manifest), args.workers, args.chunksize or 1)
+    for result in results:
+        print(json.dumps(result))
+    failed = sum(not r['ok'] for r in results)
+    print(f'{len(results) - failed}/{len(results)} jobs succeeded')
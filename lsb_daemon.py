@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import os
+import signal
+import sys
+import time
+
+from lsb_batch import run_job
+from utils.algorithms import opa_table
+from utils.indices import CACHE
+
+
+def warm():
+    """Build the lookup tables of all LSB values ahead of the first job."""
+    for k in range(1, 9):
+        opa_table(k)
+
+class _StdinReader:
+    """Line reader of stdin for the event loop, which works for pipes and files."""
+    async def readline(self):
+        return await asyncio.to_thread(sys.stdin.buffer.readline)
+
+async def _write_stdout(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+class Daemon:
+    """
+    Long-running worker which runs embed, extract, update and probe jobs from
+    a queue.
+
+    The jobs are the same as in `lsb_batch.read_manifest`, with an optional
+    "id" which is returned with the outcome. By default the jobs run on the
+    threads of a single process, so the permutation cache and the lookup
+    tables stay warm for all jobs, while numpy, zlib and PIL release the GIL
+    for most of the work. With `processes`, each worker process keeps its own
+    warm state between jobs.
+
+    Parameters
+    ----------
+    workers : None or int, optional
+        Maximum number of jobs which run concurrently. If not defined, it will
+        be the number of CPUs. Default is None.
+    queue_size : int, optional
+        Maximum number of jobs waiting to run. New jobs are not read while the
+        queue is full, which applies backpressure to the clients. Default is
+        64.
+    processes : bool, optional
+        Run the jobs on a process pool instead of a thread pool. Default is
+        False.
+
+    Examples
+    --------
+    >>> async with Daemon(workers=4) as daemon:
+    ...     future = await daemon.submit({'op': 'probe', 'stego_file': fname})
+    ...     outcome = await future
+    """
+    def __init__(self, workers=None, queue_size=64, processes=False):
+        self.workers = workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.processes = processes
+        self.completed = self.failed = 0
+
+    async def __aenter__(self):
+        if self.processes:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=warm)
+        else:
+            self.executor = ThreadPoolExecutor(self.workers)
+            warm()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+
+    async def submit(self, job):
+        """
+        Queue a job, waiting while the queue is full.
+
+        Returns
+        -------
+        asyncio.Future
+            The outcome of the job as described in `lsb_batch.run_job`, and
+            also its 'id', the 'wait' in the queue and the 'latency' from
+            submission to completion in seconds.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((dict(job), future, time.perf_counter()))
+        return future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future, submitted = await self.queue.get()
+            job_id = job.pop('id', None)
+            started = time.perf_counter()
+            try:
+                outcome = await loop.run_in_executor(self.executor, run_job, job)
+            except Exception as e:
+                # e.g., a worker process was killed
+                outcome = {'op': job.get('op', 'embed'), 'ok': False,
+                           'error': f'{type(e).__name__}: {e}',
+                           'elapsed': time.perf_counter() - started}
+            outcome.update(id=job_id, wait=started - submitted,
+                           latency=time.perf_counter() - submitted)
+            self.completed += outcome['ok']
+            self.failed += not outcome['ok']
+            if not future.cancelled():
+                future.set_result(outcome)
+            self.queue.task_done()
+
+    def stats(self):
+        """Counters of the jobs, and of the permutation cache of this process."""
+        return {'completed': self.completed, 'failed': self.failed,
+                'queued': self.queue.qsize(), 'workers': self.workers,
+                'processes': self.processes, 'cache': CACHE.stats()}
+
+    async def serve(self, reader, write):
+        """
+        Run the jobs of a stream until it ends.
+
+        Each line of the stream is a JSON object of a job, or {"op": "stats"}
+        for the `stats` of the daemon. The outcome of each job is written as a
+        JSON line in order of completion, so jobs should set an "id" to match
+        them.
+
+        Parameters
+        ----------
+        reader : object
+            Has a `readline` coroutine, e.g., `asyncio.StreamReader`.
+        write : coroutine function
+            Writes a line of output.
+        """
+        pending = set()
+
+        async def respond(future):
+            await write(json.dumps(await future))
+
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError('A job must be a JSON object')
+            except ValueError as e:
+                await write(json.dumps({'ok': False, 'error': f'{type(e).__name__}: {e}'}))
+                continue
+            if job.get('op') == 'stats':
+                await write(json.dumps(dict(self.stats(), id=job.get('id'), op='stats', ok=True)))
+                continue
+            task = asyncio.create_task(respond(await self.submit(job)))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+
+    async def serve_unix(self, path):
+        """Accept clients on a Unix socket, and `serve` each until stopped."""
+        async def client(reader, writer):
+            lock = asyncio.Lock()
+
+            async def write(line):
+                async with lock:
+                    writer.write(line.encode() + b'\n')
+                    await writer.drain()
+
+            try:
+                await self.serve(reader, write)
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(client, path)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, server.close)
+        try:
+            async with server:
+                await server.wait_closed()
+        finally:
+            os.remove(path)
+
+async def main(socket=None, workers=None, queue_size=64, processes=False):
+    """Serve jobs on a Unix socket, or from stdin to stdout if not set."""
+    async with Daemon(workers, queue_size, processes) as daemon:
+        if socket:
+            await daemon.serve_unix(socket)
+        else:
+            await daemon.serve(_StdinReader(), _write_stdout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run LSB substitution jobs from JSON lines on a long-running worker.')
+    parser.add_argument('--socket', help='Unix socket to listen on (default: stdin/stdout)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of concurrent jobs (default: number of CPUs)')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='number of waiting jobs before reading is paused')
+    parser.add_argument('--processes', action='store_true',
+                        help='run the jobs on a process pool instead of threads')
+    args = parser.parse_args()
+    asyncio.run(main(args.socket, args.workers, args.queue_size, args.processes))
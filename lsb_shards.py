@@ -0,0 +1,218 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os.path
+import zlib
+
+import lsb_substitution
+from utils.capacity import payload_capacity, shard_sizes
+from utils.compression import get_codec
+from utils.header import MAX_SHARDS, encode_fields
+import utils.io as uio
+from utils.profiling import Profile
+import utils.validation as val
+
+
+def plan(data_len, cover_files, lsb=1, channels=None, fname='', codec='store'):
+    """
+    Plan the shard sizes of a secret from the capacity of each cover.
+
+    Only the headers of the cover files are read for their shapes. The header
+    length of a shard doesn't depend on its size, so the capacities are exact.
+
+    Parameters
+    ----------
+    data_len : int
+        The length of the compressed secret.
+    cover_files : list of str
+        Paths to the cover images. The rest of the parameters are described
+        in `embed`.
+
+    Returns
+    -------
+    ndarray, int64 type
+        The length of the shard of each cover.
+    """
+    if not 0 < len(cover_files) <= MAX_SHARDS:
+        raise ValueError(f'Number of covers must be within [1, {MAX_SHARDS}], '
+                         f'but got {len(cover_files)}')
+    channels = None if channels is None else tuple(sorted(set(channels)))
+    header_len = len(encode_fields(0, 0, fname, lsb, codec, channels, fixed=True,
+                                   shard=(0, 1, 0)))
+    pixels, used, _ = lsb_substitution._cover_shapes(cover_files, channels)
+    for cover_file, n in zip(cover_files, pixels):
+        if not n:
+            raise ValueError(f'Channels {channels} can not be embedded in "{cover_file}"')
+    capacities = payload_capacity(pixels, header_len, lsb, used)
+    val.space_capacity(data_len, int(capacities.sum()))
+    return shard_sizes(data_len, capacities)
+
+def _embed_shard(cover_file, out_file, save_profile, **kwargs):
+    """Embed a shard in a cover file on a worker process."""
+    frames = uio.imread(cover_file, frames=True)
+    val.frames_format(out_file, len(frames))
+    info = lsb_substitution.embed_shard(lsb_substitution._stack(frames), **kwargs)
+    uio.imsave(frames, out_file, save_profile, frames=True)
+    return info
+
+def _extract_shard(stego_file, passwd):
+    """Extract a shard from a stego file on a worker process."""
+    stego = uio.imread(stego_file, writable=False, frames=True)
+    return lsb_substitution.extract_array(lsb_substitution._stack(stego), passwd)
+
+def embed(cover_files, secret_file, out_files, lsb=1, passwd='', compress=True,
+          channels=None, workers=None, verbose=True, save_profile='default'):
+    """
+    Embed a secret which is too large for a single cover across several
+    covers.
+
+    The secret is compressed as a whole, and split into a shard per cover in
+    proportion to the capacity of each cover. Each shard is embedded with its
+    index and the CRC-32 value of the whole secret in the header, so the
+    stego files can be extracted in any order and their reassembly is
+    verified.
+    The shards are embedded on a process pool.
+
+    Parameters
+    ----------
+    cover_files : list of str
+        Paths to the cover images, at most 256.
+    secret_file : str
+        Path to secret file.
+    out_files : list of str
+        Destination of the stego file of each cover. They must be different
+        files, and not JPEG.
+    workers : None or int, optional
+        Number of worker processes. If not defined, it will be the number of
+        CPUs. Default is None. The rest of the parameters are described in
+        `lsb_substitution.embed`, and they apply to all the covers.
+
+    Returns
+    -------
+    out : list of dict
+        The embedding info of each cover as described in
+        `lsb_substitution.embed_array`, and also its 'shard' index and the
+        'bytes' of its shard.
+    """
+    if len(out_files) != len(cover_files):
+        raise ValueError('There must be an output file for each cover')
+    if len({os.path.abspath(f) for f in out_files}) != len(out_files):
+        raise ValueError('The output files must be different')
+    for out_file in out_files:
+        val.file_format(out_file)
+    val.lsb_range(lsb)
+    secret = uio.fread(secret_file)
+    codec, secret, _ = lsb_substitution._compress(secret, compress, None, Profile())
+    sizes = plan(len(secret), cover_files, lsb, channels, secret_file, codec.name)
+
+    offsets, secret_crc = [0, *sizes.cumsum()], zlib.crc32(secret)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_embed_shard, cover_file, out_file, save_profile,
+                                   shard=bytes(secret[offsets[i]:offsets[i+1]]),
+                                   fname=secret_file, lsb=lsb, passwd=passwd, codec=codec.name,
+                                   channels=channels, index=i, count=len(cover_files),
+                                   secret_crc=secret_crc)
+                   for i, (cover_file, out_file) in enumerate(zip(cover_files, out_files))]
+        infos = [dict(f.result(), shard=i, bytes=int(sizes[i])) for i, f in enumerate(futures)]
+    if verbose:
+        for out_file, info in zip(out_files, infos):
+            print(f'{out_file}: {info["bytes"]} bytes, {info["pixels_used"]}/'
+                  f'{info["pixels_have"]} pixels used, PSNR = {info["psnr"]:2.2f}')
+    return infos
+
+def join(shards):
+    """
+    Reassemble a secret from its extracted shards in any order.
+
+    Parameters
+    ----------
+    shards : iterable of dict
+        The output of `lsb_substitution.extract_array` for each shard.
+
+    Returns
+    -------
+    out : dict
+        - 'fname': The original filename of the secret.
+        - 'codec': The name of the compression codec.
+        - 'data': The secret bytestream.
+    """
+    shards = list(shards)
+    if not shards:
+        raise ValueError('There are no shards to reassemble')
+    first = shards[0]
+    fields = ('shards', 'secret_crc', 'fname', 'codec')
+    if not first['shards'] or any(s[f] != first[f] for s in shards for f in fields):
+        raise ValueError('The files are not shards of the same secret')
+    found = {s['shard']: s['data'] for s in shards}
+    if len(found) != len(shards):
+        raise ValueError('There are duplicate shards')
+    missing = sorted(set(range(first['shards'])) - set(found))
+    if missing:
+        raise ValueError(f'Shards {missing} of {first["shards"]} are missing')
+    data = b''.join(found[i] for i in range(first['shards']))
+    val.data_integrity(data, first['secret_crc'])
+    if first['compress']:
+        data = get_codec(first['codec']).decompress(data)
+    return {'fname': first['fname'], 'codec': first['codec'], 'data': data}
+
+def extract(stego_files, passwd='', extraction_dir='', workers=None, verbose=True):
+    """
+    Extract a secret which has been embedded across several stego files.
+
+    The shards are extracted and verified on a process pool, and then
+    reassembled in the order of their index, whatever the order of
+    `stego_files`.
+
+    Parameters
+    ----------
+    stego_files : list of str
+        Paths to the stego files of all the shards.
+    extraction_dir : str, optional
+        Directory where the secret will be extracted. If not set, it will be
+        the directory of the first stego file. Default is empty string.
+    workers : None or int, optional
+        Number of worker processes. If not defined, it will be the number of
+        CPUs. Default is None. The rest of the parameters are described in
+        `lsb_substitution.extract`.
+
+    Returns
+    -------
+    str
+        Path to the extracted secret.
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        shards = list(executor.map(_extract_shard, stego_files, [passwd] * len(stego_files)))
+    secret = join(shards)
+    directory = extraction_dir or os.path.dirname(stego_files[0])
+    out_file = os.path.join(directory, f'[extracted]{secret["fname"]}')
+    uio.fsave(secret['data'], out_file)
+    if verbose:
+        print(f'Secret extracted to "{out_file}"')
+    return out_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Embed a secret across several covers, or extract it from their stego files.')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--passwd', default='', help='password of the pixel permutation')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    embed_parser = subparsers.add_parser('embed', help='split a secret across covers')
+    embed_parser.add_argument('secret_file')
+    embed_parser.add_argument('cover_files', nargs='+')
+    embed_parser.add_argument('-o', '--out-dir', default='.',
+                              help='directory of the stego files, which are saved as PNG')
+    embed_parser.add_argument('--lsb', type=int, default=1, help='number of LSBs (default: 1)')
+    extract_parser = subparsers.add_parser('extract', help='reassemble a secret from stego files')
+    extract_parser.add_argument('stego_files', nargs='+')
+    extract_parser.add_argument('-d', '--extraction-dir', default='',
+                                help='directory of the secret (default: of the first stego file)')
+    args = parser.parse_args()
+
+    if args.command == 'embed':
+        out_files = [os.path.join(args.out_dir, os.path.splitext(os.path.basename(f))[0] + '.png')
+                     for f in args.cover_files]
+        embed(args.cover_files, args.secret_file, out_files, args.lsb, args.passwd,
+              workers=args.workers)
+    else:
+        extract(args.stego_files, args.passwd, args.extraction_dir, args.workers)
@@ -1,20 +1,991 @@
-import os.path
+import io
+import os
+import zlib
 
 import numpy as np
 
-from utils.algorithms import optimal_pixel_adj
-from utils.binary import bits2bytes, bytes2bits
-from utils.compression import deflate, inflate
-from utils.header import MAX_LENGTH, decode, encode
-from utils.indices import permute_indices
+from utils.algorithms import lsb_substitute
+from utils.binary import BitStream
+import utils.capacity as capacity
+import utils.container as container
+from utils.compression import estimate_size, get_codec, select_codec
+from utils.header import MAX_LENGTH, decode, encode, encode_fields, plausible
+from utils.indices import CACHE, FEISTEL, SHUFFLE, permute_indices
 import utils.io as uio
-from utils.stats import psnr
+from utils.parallel import thread_map
+from utils.profiling import Profile
+from utils.stats import Metrics
 import utils.validation as val
 
 
 COLOR_PLANE = 2
+# Groups below which the payload pixels are processed on a single thread,
+# since the threads would cost more than they save
+PART_SIZE = 2**18
 
-def embed(cover_file, secret_file, out_file, lsb=1, passwd='', compress=True):
+def _pixels(image):
+    """2-D (pixel, channel) view, so that writing to it modifies `image`."""
+    return image.reshape((image.shape[0] * image.shape[1], -1))
+
+def _stack(frames):
+    """
+    View the frames of an image as a single image, one frame below the
+    other, so that writing to it modifies `frames`. The pixel indices are
+    permuted across all the frames, so the capacity grows with their number.
+    """
+    return frames.reshape((-1,) + frames.shape[2:])
+
+def _block(idx, channels):
+    """Index of the (pixel, channel) block, which is 1-D for a single channel."""
+    return (idx, channels[0]) if len(channels) == 1 else np.ix_(idx, channels)
+
+def _header_channel(image):
+    """The channel of the header, which is also the default embedding plane."""
+    return COLOR_PLANE if image.ndim == 3 else 0
+
+def _parts(count, unit, workers):
+    """
+    Split `count` groups into contiguous parts of whole multiples of `unit`
+    groups, one per worker, unless they would be smaller than `PART_SIZE`.
+
+    Returns
+    -------
+    list of tuple
+        The range [first, last) of groups of each part.
+    """
+    n = max(min(workers or os.cpu_count() or 1, count // PART_SIZE), 1)
+    step = max(-(-count // n // unit) * unit, unit)
+    return [(first, min(first + step, count)) for first in range(0, count, step)] or [(0, 0)]
+
+def _run_parts(func, parts, workers, profile):
+    """
+    Call `func(first, last, profile)` for each part, and return the results
+    in order. Several parts run on the thread pool, each with its own profile
+    which is then merged into `profile`. NumPy releases the GIL for the
+    gather, substitution and scatter of each part.
+    """
+    if len(parts) == 1:
+        return [func(*parts[0], profile)]
+    profiles = [Profile() for _ in parts]
+    results = thread_map(lambda part, record: func(*part, record), parts, profiles,
+                         workers=workers)
+    for record in profiles:
+        profile.merge(record)
+    return results
+
+def _permute(shape, passwd, length, start, profile, cache=CACHE):
+    """Permute the pixel positions [start, start+length) as a stage of `profile`."""
+    with profile.stage('permutation') as record:
+        idx = permute_indices(shape, passwd, length, start, cache=cache)
+        record['bytes'] = idx.nbytes
+    return idx
+
+def _shared(shape, passwd, length, start, parts):
+    """
+    The permuted positions [start, start+length) of several parts if they're
+    cached, otherwise None. Each part then permutes its own positions without
+    the cache, which would permute all the positions up to each part.
+    """
+    if len(parts) == 1 or not passwd:
+        return None
+    return CACHE.peek(shape[0] * shape[1], passwd, FEISTEL, start, start + length)
+
+def _substitute(pixels, idx, channels, stream, k, metrics, profile):
+    """
+    Embed k-bit groups in a (pixel, channel) block of the cover.
+
+    The target pixels are gathered once and the stego pixels are scattered
+    straight into the cover, so only the modified pixels are kept twice. The
+    groups are interleaved across `channels` of each pixel in `idx`. The
+    modified pixels are added to `metrics`.
+    """
+    with profile.stage('substitution', len(stream)):
+        block = _block(idx, channels)
+        original = pixels[block]
+        shape = original.shape
+        original = original.reshape(-1)
+        stego = original.copy()
+        lsb_substitute(original[:len(stream)], stream, k, out=stego[:len(stream)])
+        pixels[block] = stego.reshape(shape)
+    with profile.stage('metrics', len(stream)):
+        metrics.update(original[:len(stream)], stego[:len(stream)])
+
+def _rewrite(pixels, idx, channels, stream, k, metrics, profile):
+    """
+    Embed k-bit groups in a (pixel, channel) block of a stego image like
+    `_substitute`, but only write the pixel values whose k LSBs differ from
+    the groups. OPA is applied against their current values.
+    """
+    with profile.stage('substitution', len(stream)):
+        current = pixels[_block(idx, channels)].reshape(-1)[:len(stream)]
+        changed = np.flatnonzero((current & (2**k - 1)) != stream)
+        original = current[changed]
+        stego = lsb_substitute(original, stream[changed], k)
+        pixel, channel = np.divmod(changed, len(channels))
+        pixels[idx[pixel], np.asarray(channels)[channel]] = stego
+    with profile.stage('metrics', len(changed)):
+        metrics.update(original, stego)
+
+def _embed_chunk(pixels, shape, passwd, channels, data, k, start, metrics, profile,
+                 workers=None):
+    """
+    Embed a bytestream in the payload pixels from position `start` onwards.
+
+    A large bytestream is split into contiguous parts of whole pixels and
+    bytes, which are embedded on a thread pool. The parts write to different
+    pixels and their metrics are merged in order, so the result is identical
+    to embedding it in one go.
+
+    Returns
+    -------
+    end : int
+        The position after the last pixel used.
+    """
+    stream = BitStream(data)
+    count = stream.ngroups(k)
+    length = -(-count // len(channels))
+    val.space_capacity(start + length, len(pixels))
+    parts = _parts(count, 8 * len(channels), workers)
+    shared = _shared(shape, passwd, length, start, parts)
+
+    def embed(first, last, profile):
+        pixel, end = first // len(channels), -(-last // len(channels))
+        with profile.stage('packing', -(-(last - first) * k // 8)):
+            groups = stream.groups(k, first, last)
+        if shared is None:
+            cache = CACHE if len(parts) == 1 else None
+            idx = _permute(shape, passwd, end - pixel, start + pixel, profile, cache)
+        else:
+            idx = shared[pixel:end]
+        part = Metrics(metrics.size)
+        _substitute(pixels, idx, channels, groups, k, part, profile)
+        return part
+
+    for part in _run_parts(embed, parts, workers, profile):
+        metrics.merge(part)
+    return start + length
+
+def _embed_chunks(pixels, shape, passwd, channels, chunks, k, start, metrics, profile,
+                  workers=None):
+    """
+    Embed chunks of a bytestream one after the other.
+
+    Each chunk is embedded in whole pixels, so the bytes which don't fill
+    the last pixel are carried over to the next chunk.
+
+    Returns
+    -------
+    end : int
+        The position after the last pixel used.
+    data_len : int
+        The total length of the chunks.
+    crc : int
+        CRC-32 value of the chunks.
+    """
+    unit = k * len(channels)
+    pending = bytearray()
+    data_len, crc = 0, 0
+    for data in chunks:
+        data_len += len(data)
+        with profile.stage('validation', len(data)):
+            crc = zlib.crc32(data, crc)
+        pending += data
+        aligned = len(pending) - len(pending) % unit
+        if aligned:
+            start = _embed_chunk(pixels, shape, passwd, channels, bytes(pending[:aligned]),
+                                 k, start, metrics, profile, workers)
+            del pending[:aligned]
+    if pending:
+        start = _embed_chunk(pixels, shape, passwd, channels, bytes(pending), k, start,
+                             metrics, profile, workers)
+    return start, data_len, crc
+
+def _read_chunks(f, chunk_size, compress, profile, block_size=None):
+    """
+    Read the secret from a binary file object in chunks and compress them
+    incrementally, or split them into a block container if `block_size` is
+    set.
+
+    The codec is selected on the first chunk, because the compressed bytes are
+    embedded before the rest of the secret is read.
+
+    Returns
+    -------
+    codec : Codec
+        The codec which compresses the chunks.
+    compressor : object
+        The incremental compressor of the chunks, which is a
+        `utils.container.BlockWriter` for a block container.
+    chunks : generator of bytes
+        The chunks of the secret bytestream to embed.
+    """
+    def read(f):
+        with profile.stage('read') as record:
+            data = f.read(chunk_size)
+            record['bytes'] = len(data)
+        return data
+
+    first = read(f)
+    with profile.stage('compression'):
+        codec = select_codec(compress, first)
+        if block_size is None:
+            compressor = codec.compressor()
+        else:
+            compressor = container.BlockWriter(codec, block_size)
+
+    def chunks():
+        data = first
+        while data:
+            with profile.stage('compression', len(data)):
+                chunk = compressor.compress(data)
+            yield chunk
+            data = read(f)
+        with profile.stage('compression'):
+            chunk = compressor.flush()
+        yield chunk
+
+    return codec, compressor, chunks()
+
+def _read_header(stego, passwd, profile, legacy=True):
+    """
+    Decode the header and find which scheme permuted the pixel indices.
+
+    Stego files with an unversioned header have been embedded with the
+    'shuffle' scheme. Their header has to be read in that order, which is
+    only attempted with `legacy` if it can't be read in 'feistel' order,
+    since it permutes the whole image.
+    """
+    pixels = _pixels(stego)
+    plane = pixels[:,_header_channel(stego)]
+    shape = stego.shape[:2]
+    length = min(MAX_LENGTH, len(plane))
+    with profile.stage('header', length // 8):
+        idx = permute_indices(shape, passwd, length)
+        header = decode(plane[idx] & 0x01)
+        if legacy and passwd and not (header['version'] and plausible(header, *pixels.shape)):
+            idx = permute_indices(shape, passwd, length, scheme=SHUFFLE)
+            header = decode(plane[idx] & 0x01)
+    scheme = FEISTEL if header['version'] else SHUFFLE
+    return header, scheme
+
+def _read_groups(pixels, shape, passwd, channels, k, start, offset, count, profile,
+                 workers=None, idx=None):
+    """
+    Read k-bit groups of the payload and combine them to bytes.
+
+    The `count` groups start `offset` groups into the pixel at position
+    `start` of the permuted sequence. A large read is split into contiguous
+    parts of whole bytes, which are read on a thread pool.
+
+    Parameters
+    ----------
+    idx : None or ndarray, optional
+        The permuted positions from `start` onwards, if they have already been
+        computed, e.g., for the 'shuffle' scheme. Default is None.
+
+    Returns
+    -------
+    ndarray, uint8 type
+        The bytes of the groups.
+    """
+    length = -(-(offset + count) // len(channels))
+    parts = _parts(count, 8, workers)
+    if idx is None:
+        idx = _shared(shape, passwd, length, start, parts)
+    mask = 2**k - 1
+
+    def read(first, last, profile):
+        pixel, end = (offset + first) // len(channels), -(-(offset + last) // len(channels))
+        if idx is None:
+            cache = CACHE if len(parts) == 1 else None
+            part = _permute(shape, passwd, end - pixel, start + pixel, profile, cache)
+        else:
+            part = idx[pixel:end]
+        with profile.stage('packing') as record:
+            skip = offset + first - pixel * len(channels)
+            stream = pixels[_block(part, channels)].reshape(-1)[skip:skip+last-first]
+            # The gathered pixels are a copy, so they're masked in place
+            stream &= mask
+            data = BitStream.from_groups(stream, k).data
+            record['bytes'] = len(data)
+        return data
+
+    data = _run_parts(read, parts, workers, profile)
+    return data[0] if len(data) == 1 else np.concatenate(data)
+
+def _check_payload(stego, header):
+    """
+    Reject a header whose payload doesn't fit in the image, e.g., which has
+    been decoded with a wrong password, before anything is extracted.
+    """
+    pixels = _pixels(stego)
+    channels = header['channels'] or (_header_channel(stego),)
+    val.channels(channels, pixels.shape[1])
+    groups = -(-header['data_len'] * 8 // header['lsb'])
+    end = header['header_len'] + -(-groups // len(channels))
+    if end > len(pixels):
+        raise ValueError(f'The header describes a secret in {end:,} pixels, but the image has '
+                         f'{len(pixels):,}. The password may be wrong or the image corrupted.')
+
+def _extract_chunks(stego, header, scheme, passwd, chunk_size, profile, workers=None):
+    """
+    Extract, verify and decompress the secret in chunks.
+
+    The CRC is verified before the last chunk is output, so a secret which is
+    extracted in a single chunk is never output unverified.
+
+    Returns
+    -------
+    generator of bytes
+        The chunks of the secret.
+    """
+    _check_payload(stego, header)
+    if header['block_size']:
+        yield from _extract_blocks(stego, header, passwd, chunk_size, profile, workers=workers)
+        return
+    pixels = _pixels(stego)
+    shape = stego.shape[:2]
+    header_len = header['header_len']
+    lsb = header['lsb']
+    channels = header['channels'] or (_header_channel(stego),)
+
+    data_len = header['data_len']
+    bitlength = int(np.ceil(data_len * 8 / lsb))
+    # Each chunk is a whole number of bytes and pixels
+    unit = 8 * len(channels)
+    if chunk_size is None:
+        step = max(bitlength, 1)
+    else:
+        step = max(chunk_size * 8 // lsb // unit, 1) * unit
+    if scheme == SHUFFLE:
+        # The whole image is shuffled anyway, so this is only done once
+        length = -(-bitlength // len(channels))
+        with profile.stage('permutation') as record:
+            shuffled = permute_indices(shape, passwd, length, header_len, scheme)
+            record['bytes'] = shuffled.nbytes
+
+    # Shards are only decompressed once they have been reassembled
+    decompress = None
+    if header['compress'] and not header['shards']:
+        decompress = get_codec(header['codec']).decompressor()
+    crc, remaining = 0, data_len
+    for group in range(0, bitlength, step):
+        groups = min(step, bitlength - group)
+        start = group // len(channels)
+        idx = shuffled[start:] if scheme == SHUFFLE else None
+        data = _read_groups(pixels, shape, passwd, channels, lsb, header_len + start, 0, groups,
+                            profile, workers, idx)[:remaining]
+        remaining -= len(data)
+        with profile.stage('validation', len(data)):
+            crc = zlib.crc32(data, crc)
+            if not remaining:
+                val.checksum(crc, header['crc'])
+        if decompress:
+            with profile.stage('decompression', len(data)):
+                data = decompress.decompress(data)
+                if not remaining:
+                    data += decompress.flush()
+        yield data.tobytes() if isinstance(data, np.ndarray) else data
+    if remaining:
+        raise ValueError('Data integrity not verified: the secret is truncated.')
+    if not data_len:
+        # An empty secret has no chunks, but its CRC is checked all the same
+        val.checksum(crc, header['crc'])
+
+def _read_payload(stego, header, passwd, start, stop, profile, workers=None):
+    """
+    Read the bytes [start, stop) of the embedded bytestream.
+
+    Only the pixels which hold them are permuted and read, which requires the
+    'feistel' scheme.
+    """
+    _check_payload(stego, header)
+    pixels = _pixels(stego)
+    lsb = header['lsb']
+    channels = header['channels'] or (_header_channel(stego),)
+    bitlength = -(-header['data_len'] * 8 // lsb)
+    # Every `lsb` bytes are 8 whole groups
+    first, last = start // lsb, -(-stop // lsb)
+    group, end = 8 * first, min(8 * last, bitlength)
+    pixel = group // len(channels)
+    data = _read_groups(pixels, stego.shape[:2], passwd, channels, lsb,
+                        header['header_len'] + pixel, group - pixel * len(channels),
+                        end - group, profile, workers)
+    return data[start-first*lsb:stop-first*lsb].tobytes()
+
+def _read_index(stego, header, passwd, profile):
+    """Read and verify the index of a block container."""
+    data_len, block_size = header['data_len'], header['block_size']
+    if data_len < container.TRAILER_SIZE:
+        raise ValueError('Block index is corrupted.')
+    trailer = _read_payload(stego, header, passwd, data_len - container.TRAILER_SIZE, data_len,
+                            profile)
+    size = container.index_size(int.from_bytes(trailer, 'little'), block_size)
+    if size > data_len:
+        raise ValueError('Block index is corrupted.')
+    data = _read_payload(stego, header, passwd, data_len - size, data_len, profile)
+    with profile.stage('validation', len(data)):
+        val.checksum(zlib.crc32(data), header['crc'])
+    return container.Index(data, block_size)
+
+def _extract_blocks(stego, header, passwd, chunk_size, profile, start=0, stop=None,
+                    workers=None):
+    """
+    Extract, verify and decompress the bytes [start, stop) of a secret in a
+    block container.
+
+    The index is read first, and then only the blocks which hold the range.
+    Each chunk of blocks is verified and decompressed on a thread pool, and
+    it's output as soon as it's verified.
+
+    Returns
+    -------
+    generator of bytes
+        The chunks of the secret.
+    """
+    index = _read_index(stego, header, passwd, profile)
+    stop = index.raw_len if stop is None else min(stop, index.raw_len)
+    first, last = index.blocks(start, stop)
+    step = max(last - first if chunk_size is None else chunk_size // index.block_size, 1)
+    codec = get_codec(header['codec'])
+    for block in range(first, last, step):
+        end = min(block + step, last)
+        stored = _read_payload(stego, header, passwd, int(index.offsets[block]),
+                               int(index.offsets[end]), profile, workers)
+        blocks = container.split(stored, index, block, end)
+        with profile.stage('validation', len(stored)):
+            container.verify(blocks, index, block)
+        with profile.stage('decompression', len(stored)):
+            data = b''.join(container.decompress(blocks, codec))
+        offset = block * index.block_size
+        yield data[max(start - offset, 0):stop - offset]
+
+def _prepare(cover, lsb, channels):
+    """
+    Check the embedding parameters of a cover.
+
+    Returns
+    -------
+    pixels : ndarray
+        The (pixel, channel) view of the cover.
+    channels : tuple of int
+        The sorted embedding channels.
+    metrics : Metrics
+        The quality metrics of the embedding, which are empty.
+    """
+    val.lsb_range(lsb)
+    val.writable(cover)
+    pixels = _pixels(cover)
+    header_channel = _header_channel(cover)
+    channels = (header_channel,) if channels is None else tuple(sorted(set(channels)))
+    val.channels(channels, pixels.shape[1])
+    return pixels, channels, Metrics(len(pixels) * len(set(channels) | {header_channel}))
+
+def _compress(secret, compress, block_size, profile):
+    """
+    Compress a whole secret, or split it into a block container if
+    `block_size` is set. The secret is stored uncompressed if compression
+    doesn't make it smaller.
+
+    Returns
+    -------
+    codec : Codec
+        The codec which has compressed the secret.
+    payload : bytes-like object
+        The bytestream to embed.
+    index : None or bytes
+        The index of the block container, whose CRC-32 is the checksum of the
+        header.
+    """
+    secret = memoryview(secret).cast('B')
+    index = None
+    with profile.stage('compression', len(secret)):
+        codec = select_codec(compress, secret)
+        if block_size is not None:
+            payload, index = container.pack(secret, codec, block_size)
+            if codec.id and len(payload) >= len(secret) + len(index):
+                codec = get_codec('store')
+                payload, index = container.pack(secret, codec, block_size)
+            secret = payload
+        elif codec.id:
+            temp = codec.compress(secret)
+            if len(temp) < len(secret):
+                secret = temp
+            else:
+                codec = get_codec('store')
+    return codec, secret, index
+
+def _cover_shapes(covers, channels):
+    """
+    Find the capacity of each cover from the shape of its pixel array, or of
+    its image file, whose header is read without decoding the pixels.
+
+    Returns
+    -------
+    pixels : list of int
+        The pixels of each cover, whose frames all count, or 0 if the
+        embedding channels don't exist in it, see `val.channels`.
+    used : list of int
+        The number of embedding channels of each cover.
+    size : list of int
+        The number of pixel values which may change in each cover, in the
+        embedding channels and the header channel.
+    """
+    pixels, used, size = [], [], []
+    for cover in covers:
+        if isinstance(cover, np.ndarray):
+            shape = cover.shape
+        else:
+            shape = uio.imshape(cover, frames=True)
+            shape = (shape[0] * shape[1],) + shape[2:]
+        have = shape[2] if len(shape) == 3 else 1
+        header_channel = COLOR_PLANE if len(shape) == 3 else 0
+        embedding = (header_channel,) if channels is None else channels
+        n = shape[0] * shape[1]
+        if not all(0 <= c < have for c in embedding + (header_channel,)):
+            n = 0
+        pixels.append(n)
+        used.append(len(embedding))
+        size.append(shape[0] * shape[1] * len(set(embedding) | {header_channel}))
+    return pixels, used, size
+
+def _info(cover, end, codec, metrics, profile):
+    """Report the embedding info, which is also recorded in the profile."""
+    info = {'pixels_used': end, 'pixels_have': cover.shape[0] * cover.shape[1],
+            'psnr': metrics.psnr, 'max_error': metrics.max_error, 'compress': codec.id != 0,
+            'codec': codec.name}
+    profile.info.update(info)
+    return info
+
+def _embed_header(cover, passwd, header, end, codec, metrics, profile):
+    """Embed the header in the first pixels, and report the embedding info."""
+    with profile.stage('permutation') as record:
+        idx = permute_indices(cover.shape[:2], passwd, len(header))
+        record['bytes'] = idx.nbytes
+    _substitute(_pixels(cover), idx, (_header_channel(cover),), header, 1, metrics, profile)
+    return _info(cover, end, codec, metrics, profile)
+
+def embed_array(cover, secret, fname='', lsb=1, passwd='', compress=True, channels=None,
+                chunk_size=None, profile=None, block_size=None, workers=None):
+    """
+    Embed a secret to a pixel array with the LSB substitution algorithm.
+
+    Parameters
+    ----------
+    cover : ndarray, uint8 type
+        The pixels of the cover image, which are modified in place, so it must
+        be a writable C-contiguous array. Pass a copy to keep the original
+        cover.
+    secret : bytes-like or file-like object
+        The secret as a bytestream, e.g., bytes, bytearray, memoryview or uint8
+        ndarray, or as a binary file object to read it from.
+    fname : str, optional
+        The filename of the secret stored in the header. Default is empty
+        string. The rest of the parameters are described in `embed`.
+
+    Returns
+    -------
+    out : dict
+        - 'pixels_used': The number of pixels used, including the header.
+        - 'pixels_have': The number of pixels of the cover.
+        - 'psnr': The PSNR of the stego image against the cover.
+        - 'max_error': The maximum absolute difference of a pixel value from
+                       the cover.
+        - 'compress': Whether the secret has been compressed.
+        - 'codec': The name of the compression codec.
+
+    See also
+    --------
+    embed : Embed a secret file to an image file.
+    """
+    profile = Profile() if profile is None else profile
+    pixels, channels, metrics = _prepare(cover, lsb, channels)
+    shape = cover.shape[:2]
+
+    if chunk_size is None:
+        if hasattr(secret, 'read'):
+            with profile.stage('read') as record:
+                secret = secret.read()
+                record['bytes'] = len(secret)
+        codec, secret, index = _compress(secret, compress, block_size, profile)
+        with profile.stage('header') as record:
+            if block_size is None:
+                header = encode(secret, fname, lsb, codec.name, channels)
+            else:
+                header = encode_fields(len(secret), zlib.crc32(index), fname, lsb, codec.name,
+                                       channels, block_size=block_size)
+            record['bytes'] = len(header) // 8
+        header_len = len(header)
+        end = _embed_chunk(pixels, shape, passwd, channels, secret, lsb, header_len, metrics,
+                           profile, workers)
+    else:
+        # The header is embedded last, because the length and checksum of the
+        # secret are only known after all the chunks have been embedded
+        f = secret if hasattr(secret, 'read') else io.BytesIO(secret)
+        codec, compressor, chunks = _read_chunks(f, chunk_size, compress, profile, block_size)
+        header_len = len(encode_fields(0, 0, fname, lsb, codec.name, channels, fixed=True,
+                                       block_size=block_size))
+        end, data_len, crc = _embed_chunks(pixels, shape, passwd, channels, chunks,
+                                           lsb, header_len, metrics, profile, workers)
+        if block_size is not None:
+            crc = zlib.crc32(compressor.index)
+        with profile.stage('header', header_len // 8):
+            header = encode_fields(data_len, crc, fname, lsb, codec.name, channels, fixed=True,
+                                   block_size=block_size)
+    return _embed_header(cover, passwd, header, end, codec, metrics, profile)
+
+def embed_shard(cover, shard, fname, lsb, passwd, codec, channels, index, count, secret_crc,
+                profile=None):
+    """
+    Embed a shard of a secret which has been compressed as a whole and split
+    across several covers.
+
+    The header records the shard `index` of `count` shards, and the codec and
+    CRC-32 value `secret_crc` of the whole compressed secret. The shards are
+    reassembled and decompressed by `lsb_shards.extract`.
+
+    Parameters
+    ----------
+    cover : ndarray, uint8 type
+        The pixels of the cover image, which are modified in place, so it must
+        be a writable C-contiguous array.
+    shard : bytes-like object
+        The part of the compressed secret.
+    codec : str
+        The name of the codec which has compressed the whole secret. The rest
+        of the parameters are described in `embed_array`.
+
+    Returns
+    -------
+    out : dict
+        The embedding info as described in `embed_array`.
+    """
+    profile = Profile() if profile is None else profile
+    pixels, channels, metrics = _prepare(cover, lsb, channels)
+    shard = memoryview(shard).cast('B')
+    with profile.stage('header') as record:
+        header = encode_fields(len(shard), zlib.crc32(shard), fname, lsb, codec, channels,
+                               fixed=True, shard=(index, count, secret_crc))
+        record['bytes'] = len(header) // 8
+    end = _embed_chunk(pixels, cover.shape[:2], passwd, channels, shard, lsb, len(header),
+                       metrics, profile)
+    return _embed_header(cover, passwd, header, end, get_codec(codec), metrics, profile)
+
+def update_array(stego, secret, fname='', passwd='', compress=None, profile=None):
+    """
+    Replace the secret of a stego pixel array in place, without the cover.
+
+    The header of the existing secret gives its LSB value, channels and block
+    size, and the new secret is embedded with them in the same sequence of
+    permuted pixels. The old and new bitstreams are compared pixel by pixel,
+    and only the pixel values whose LSBs differ are rewritten, with OPA
+    against their current value. The header keeps its length if it can, so
+    that a secret which changes slightly only changes a few pixels. The
+    pixels of an old secret which was longer than the new one are left as
+    they are.
+
+    Parameters
+    ----------
+    stego : ndarray, uint8 type
+        The pixels of the stego image, which are modified in place, so it must
+        be a writable C-contiguous array. Its secret must have been embedded
+        with the 'feistel' scheme, and it is verified before anything is
+        written.
+    secret : bytes-like object
+        The new secret.
+    fname : str, optional
+        The filename of the new secret stored in the header. Default is empty
+        string.
+    compress : None, bool or str, optional
+        Compression of the new secret as described in `embed`. If not
+        defined, the codec of the existing secret is used. Default is None.
+        The rest of the parameters are described in `embed`.
+
+    Returns
+    -------
+    out : dict
+        The embedding info as described in `embed_array`, where 'psnr' and
+        'max_error' are against the stego image before the update, and also
+        - 'pixels_changed': The number of pixel values rewritten.
+    """
+    profile = Profile() if profile is None else profile
+    old, scheme = _read_header(stego, passwd, profile)
+    if scheme != FEISTEL or not plausible(old, *_pixels(stego).shape):
+        raise ValueError('No secret embedded with the feistel scheme was found. '
+                         'The password may be wrong.')
+    if old['shards']:
+        raise ValueError('Shards are updated by embedding the secret again with `lsb_shards`')
+    # Writing to the pixels of a wrong password would destroy the secret
+    if old['block_size']:
+        _read_index(stego, old, passwd, profile)
+    else:
+        data = _read_payload(stego, old, passwd, 0, old['data_len'], profile)
+        with profile.stage('validation', len(data)):
+            val.checksum(zlib.crc32(data), old['crc'])
+    lsb, block_size = old['lsb'], old['block_size']
+    pixels, channels, metrics = _prepare(stego, lsb, old['channels'])
+    shape = stego.shape[:2]
+
+    codec, payload, index = _compress(secret, old['codec'] if compress is None else compress,
+                                      block_size, profile)
+    with profile.stage('header') as record:
+        crc = zlib.crc32(payload if index is None else index)
+        headers = [encode_fields(len(payload), crc, fname, lsb, codec.name, old['channels'],
+                                 fixed=fixed, block_size=block_size) for fixed in (False, True)]
+        header = next((h for h in headers if len(h) == old['header_len']), headers[0])
+        record['bytes'] = len(header) // 8
+    with profile.stage('packing', len(payload)):
+        stream = BitStream(payload).groups(lsb)
+    end = len(header) + -(-len(stream) // len(channels))
+    val.space_capacity(end, len(pixels))
+    with profile.stage('permutation') as record:
+        idx = permute_indices(shape, passwd, end - len(header), len(header))
+        record['bytes'] = idx.nbytes
+    _rewrite(pixels, idx, channels, stream, lsb, metrics, profile)
+    with profile.stage('permutation') as record:
+        idx = permute_indices(shape, passwd, len(header))
+        record['bytes'] = idx.nbytes
+    _rewrite(pixels, idx, (_header_channel(stego),), header, 1, metrics, profile)
+    return dict(_info(stego, end, codec, metrics, profile), pixels_changed=metrics.changed)
+
+def extract_array(stego, passwd='', chunk_size=None, profile=None, start=0, stop=None,
+                  workers=None):
+    """
+    Extract a secret from a pixel array embedded with the LSB substitution
+    algorithm.
+
+    Parameters
+    ----------
+    stego : ndarray, uint8 type
+        The pixels of the stego image.
+    start, stop : int, optional
+        Extract only the bytes [start, stop) of the secret. If the secret has
+        been embedded in a block container, only the blocks which hold them
+        are read, verified and decompressed. Otherwise the whole secret is
+        extracted. Default is the whole secret. The rest of the parameters are
+        described in `extract`.
+
+    Returns
+    -------
+    out : dict
+        The header info as described in `utils.header.decode`, e.g., 'fname',
+        'lsb' and 'compress', and the secret bytestream in 'data'. The
+        'data' of a shard is left compressed until it's reassembled.
+
+    See also
+    --------
+    embed_array : Embed secret. What this function reverses.
+    """
+    profile = Profile() if profile is None else profile
+    header, scheme = _read_header(stego, passwd, profile)
+    if header['block_size']:
+        chunks = _extract_blocks(stego, header, passwd, chunk_size, profile, start, stop,
+                                 workers)
+        return dict(header, data=b''.join(chunks))
+    data = b''.join(_extract_chunks(stego, header, scheme, passwd, chunk_size, profile,
+                                    workers))
+    return dict(header, data=data[start:stop])
+
+def embed_bytes(cover, secret, fname='', fmt='png', lsb=1, passwd='', compress=True,
+                channels=None, chunk_size=None, profile=None, save_profile='default',
+                block_size=None, workers=None):
+    """
+    Embed a secret to an in-memory image without any temporary files.
+
+    Parameters
+    ----------
+    cover : ndarray, bytes-like or file-like object
+        The pixels of the cover image, which are not modified, or an encoded
+        image, e.g., the bytes of a PNG file.
+    fmt : str, optional
+        Image format of the stego image, e.g., 'png', 'bmp', 'tiff' or 'npy'. It
+        must not be JPEG as it is incompatible with the algorithm. Default is
+        'png'.
+    save_profile : str, optional
+        Encoder settings from `utils.io.SAVE_PROFILES`, e.g., 'fast'. Default is
+        'default'. The rest of the parameters are described in `embed_array`.
+
+    Returns
+    -------
+    bytes
+        The encoded stego image.
+    """
+    val.file_format(f'stego.{fmt}')
+    profile = Profile() if profile is None else profile
+    with profile.stage('read') as record:
+        if isinstance(cover, np.ndarray):
+            frames = np.array(cover)[None]
+        else:
+            frames = uio.imdecode(cover, frames=True)
+        record['bytes'] = frames.nbytes
+    val.frames_format(f'stego.{fmt}', len(frames))
+    embed_array(_stack(frames), secret, fname, lsb, passwd, compress, channels, chunk_size,
+                profile, block_size, workers)
+    with profile.stage('write') as record:
+        stego = uio.imencode(frames, fmt, save_profile, frames=True)
+        record['bytes'] = len(stego)
+    return stego
+
+def extract_bytes(stego, passwd='', chunk_size=None, profile=None, start=0, stop=None,
+                  workers=None):
+    """
+    Extract a secret from an in-memory image without any temporary files.
+
+    Parameters
+    ----------
+    stego : ndarray, bytes-like or file-like object
+        The pixels of the stego image, or an encoded image, e.g., the bytes of
+        a PNG file. The rest of the parameters are described in
+        `extract_array`.
+
+    Returns
+    -------
+    out : dict
+        The header info and the secret bytestream, as described in
+        `extract_array`.
+    """
+    profile = Profile() if profile is None else profile
+    if not isinstance(stego, np.ndarray):
+        with profile.stage('read') as record:
+            stego = _stack(uio.imdecode(stego, writable=False, frames=True))
+            record['bytes'] = stego.nbytes
+    return extract_array(stego, passwd, chunk_size, profile, start, stop, workers)
+
+def probe_array(stego, passwd='', profile=None, legacy=False):
+    """
+    Read the header of a stego pixel array without extracting the secret.
+
+    Only the pixels of the header are permuted and read, which makes this
+    much faster than `extract_array` for finding whether an image carries a
+    payload and how large it is.
+
+    Parameters
+    ----------
+    stego : ndarray, uint8 type
+        The pixels of the image.
+    legacy : bool, optional
+        Also look for a header of the older 'shuffle' scheme if there is no
+        plausible one of the 'feistel' scheme. That permutes all the pixels
+        of the image, which is slow for the images without a payload. Default
+        is False. The rest of the parameters are described in `extract`.
+
+    Returns
+    -------
+    out : dict
+        The header info as described in `utils.header.decode`, e.g.,
+        'data_len', 'lsb', 'fname' and 'compress', and also
+        - 'scheme': The scheme which permuted the pixel indices.
+        - 'plausible': Whether the header describes a payload which fits in the
+                       image. An image without a payload, or with a different
+                       password, decodes to a random header, which is most
+                       likely implausible. This is not a guarantee, which only
+                       the CRC check of the extraction provides.
+    """
+    profile = Profile() if profile is None else profile
+    header, scheme = _read_header(stego, passwd, profile, legacy)
+    # Without `legacy`, an unversioned header has been read in 'feistel' order,
+    # so it isn't the header of either scheme
+    verdict = plausible(header, *_pixels(stego).shape) and (legacy or not passwd
+                                                            or scheme == FEISTEL)
+    return dict(header, scheme=scheme, plausible=verdict)
+
+def probe(stego_file, passwd='', mmap=False, profile=None, legacy=False):
+    """
+    Read the header of a stego file without extracting the secret.
+
+    With `mmap`, only the pixels of the header are read from an uncompressed
+    single-frame image, otherwise the whole image is decoded. The parameters
+    are described in `extract` and `probe_array`, and the output in
+    `probe_array`.
+    """
+    profile = Profile() if profile is None else profile
+    with profile.stage('read') as record:
+        if mmap:
+            stego = uio.immap(stego_file)
+        else:
+            stego = _stack(uio.imread(stego_file, writable=False, frames=True))
+        record['bytes'] = stego.nbytes
+    return probe_array(stego, passwd, profile, legacy)
+
+def plan(secret, covers, fname=None, compress=True, channels=None, chunk_size=None,
+         margin=0.05, block_size=None):
+    """
+    Find the cover and LSB value of least distortion for a secret without
+    embedding it.
+
+    The compressed size of the secret is estimated from a sample of it, and
+    the exact header length and pixels needed at every LSB value are computed
+    for all the covers at once from their shapes. Image files are not
+    decoded, and a secret file is memory-mapped so that only its sample is
+    read.
+
+    Parameters
+    ----------
+    secret : str or bytes-like object
+        Path to the secret file, or the secret bytestream.
+    covers : iterable of str or ndarray
+        Paths to the cover images, whose frames all count, or their pixel
+        arrays.
+    fname : None or str, optional
+        The filename of the secret stored in the header. If not defined, it
+        will be the path of the secret file, or empty for a bytestream.
+        Default is None.
+    margin : float, optional
+        Fraction the estimated compressed size is increased by, as the
+        compression ratio of a sample may be higher than that of the whole
+        secret. A secret which fits in the sample is compressed whole instead.
+        Default is 0.05. The rest of the parameters are described in `embed`.
+
+    Returns
+    -------
+    out : dict
+        - 'cover': The index of the cover of least distortion, or None if the
+                   secret doesn't fit in any cover.
+        - 'lsb': Its minimal LSB value, or None.
+        - 'psnr': Its expected PSNR, or None.
+        - 'codec': The name of the compression codec.
+        - 'data_len': The estimated length of the embedded bytestream.
+        - 'exact': Whether 'data_len' is exact.
+        - 'header_len': The length of the header in pixels.
+        - 'covers': A dict of 'lsb', 'pixels_needed', 'pixels_have' and
+                    'psnr' of each cover as described in
+                    `utils.capacity.plan`.
+    """
+    if isinstance(secret, (str, os.PathLike)):
+        fname = secret if fname is None else fname
+        secret = uio.fmap(secret)
+    fname = fname or ''
+    data = memoryview(secret).cast('B')
+    if chunk_size is None:
+        codec, data_len, exact = estimate_size(compress, data, block_size=block_size)
+    else:
+        # The codec is selected on the first chunk, and the compressed chunks
+        # are never embedded uncompressed
+        codec = select_codec(compress, data[:chunk_size])
+        _, data_len, exact = estimate_size(codec.name, data, block_size=block_size)
+        exact = exact and codec.id == 0
+    if not exact:
+        data_len = min(int(np.ceil(data_len * (1 + margin))), len(data))
+    if block_size is not None:
+        data_len += container.index_size(len(data), block_size)
+    channels = None if channels is None else tuple(sorted(set(channels)))
+    header_len = len(encode_fields(data_len, 0, fname, 1, codec.name, channels,
+                                   fixed=chunk_size is not None, block_size=block_size))
+    pixels, used, size = _cover_shapes(covers, channels)
+
+    out = capacity.plan(data_len, header_len, pixels, used, size)
+    best = out['best']
+    return {'cover': best,
+            'lsb': None if best is None else int(out['lsb'][best]),
+            'psnr': None if best is None else float(out['psnr'][best]),
+            'codec': codec.name, 'data_len': data_len, 'exact': exact,
+            'header_len': header_len,
+            'covers': {'lsb': out['lsb'], 'pixels_needed': out['pixels_needed'],
+                       'pixels_have': np.array(pixels), 'psnr': out['psnr']}}
+
+def embed(cover_file, secret_file, out_file, lsb=1, passwd='', compress=True,
+          channels=None, chunk_size=None, mmap=False, profile=None, verbose=True,
+          save_profile='default', block_size=None, workers=None):
     """
     Embed a secret to an image with the pixel LSB substitution algorithm.
 
@@ -22,25 +993,76 @@ def embed(cover_file, secret_file, out_file, lsb=1, passwd='', compress=True):
     ----------
     cover_file : str
         Path to cover image. If this a color image, the secret will be embedded
-        in the B color channel.
+        in the B color channel, unless `channels` is set. All the frames of a
+        multi-frame image, e.g., an animated PNG or GIF, or a multi-page TIFF,
+        are used as capacity.
     secret_file : str
         Path to secret file.
     out_file : str
         Destination for stego file. It must not be JPEG format as it is
-        incompatible with the algorithm.
+        incompatible with the algorithm. The stego file of a multi-frame cover
+        must be PNG or TIFF, which are saved with all the frames in one pass.
     lsb : int, optional
         Number of LSBs to embed the secret in. It must be in the range [1-8].
         Higher values introduce more distortion. Default is 1.
     passwd : str, optional
         Password to randomise the pixels where the secret will be embedded. This
         can be used to thwart sequential embedding steganalysis. If not set, the
-        secret will be embedded sequentially. Using a password makes the code
-        depend on numpy's PRNG and can't easily be ported to another language
-        without implementating that feature exactly. Default is empty string.
-    compress : bool, optional
-        Compress the secret using gzip before embedding. If the compressed data
-        is larger than the original secret, the algorithm will default to no
-        compression even if the argument was set to True. Default is True.
+        secret will be embedded sequentially. The pixels are permuted with a
+        keyed Feistel network, so only the pixels needed for embedding are
+        computed. Default is empty string.
+    compress : bool or str, optional
+        Compress the secret before embedding. True or 'auto' selects the codec
+        which compresses a sample of the secret the most, a codec name of
+        `utils.compression.CODECS`, e.g., 'zlib-9', 'bz2', 'lzma' or 'pzlib-9',
+        which compresses and decompresses blocks of the secret on multiple
+        cores, selects that codec, and False disables compression. The secret is not
+        compressed if the byte entropy of a sample shows it's incompressible,
+        e.g., an image or archive, or if the compressed data is larger than the
+        original secret. Default is True.
+    channels : None or iterable of int, optional
+        Color channels of the cover to embed the secret in, e.g., (0, 1, 2) for
+        RGB. The secret is interleaved across the channels of each pixel, which
+        multiplies the capacity by the number of channels at the same
+        distortion per channel. If not set, only the B channel of a color image
+        is used. Default is None.
+    chunk_size : None or int, optional
+        If set, the secret is read, compressed and embedded in chunks of this
+        many bytes, so that memory use depends on the chunk size instead of the
+        secret size. The codec is then selected on the first chunk. If
+        not set, the whole secret is read at once. Default is None.
+    mmap : bool, optional
+        Memory-map the cover instead of decoding it, so that only the pixels
+        used for embedding are read and written. The cover must be a .npy file
+        or an uncompressed single-frame image, e.g., TIFF or PPM/PGM, and `out_file` must
+        have the same format. The cover file is copied to `out_file` and then
+        modified in place, or the cover itself is modified if `out_file` is the
+        same path. A failed embedding may leave `out_file` partially written.
+        Default is False.
+    profile : None or Profile, optional
+        If set, the duration and bytes processed of each stage are recorded in
+        it: 'read', 'compression', 'header', 'permutation', 'packing',
+        'substitution', 'metrics', 'validation' (CRC) and 'write'. The pixels
+        used and the PSNR are recorded in its `info`. Default is None.
+    verbose : bool, optional
+        Print the pixels used and the PSNR. Default is True.
+    save_profile : str, optional
+        Encoder settings of the stego file from `utils.io.SAVE_PROFILES`, e.g.,
+        'fast' for a PNG which is quicker to save but larger. Lossless formats
+        such as BMP, PPM/PGM, uncompressed TIFF and .npy are faster still for
+        intermediate files. Default is 'default'.
+    block_size : None or int, optional
+        If set, the secret is split into blocks of this many bytes, which are
+        compressed independently and checksummed with their own CRC-32, in a
+        container with an index of the blocks (see `utils.container`). A byte
+        range of the secret can then be extracted by reading only its blocks,
+        and the blocks are verified and decompressed in parallel. It must be a
+        power of 2 in the range [4 KiB, 64 MiB]. Default is None.
+    workers : None or int, optional
+        Number of threads the payload pixels of a large secret are embedded
+        on, in contiguous parts of the permuted pixels. The stego image is
+        identical to that of a single thread. If not defined, it will be the
+        number of CPUs. Default is None.
 
     Returns
     -------
@@ -53,47 +1075,97 @@ def embed(cover_file, secret_file, out_file, lsb=1, passwd='', compress=True):
     """
     val.lsb_range(lsb)
     val.file_format(out_file)
+    profile = Profile() if profile is None else profile
     
-    cover = uio.imread(cover_file)
-    secret = uio.fread(secret_file)
-    if compress:
-        temp = deflate(secret)
-        if len(temp) < len(secret):
-            secret = temp
+    with profile.stage('read') as record:
+        if mmap:
+            val.same_format(cover_file, out_file)
+            cover = uio.immap(out_file, 'r+', source=cover_file)
         else:
-            compress = False
-
-    header = encode(secret, secret_file, lsb, compress)
-    stream = bytes2bits(secret, lsb)
-    header_len = len(header)
-    pixels_needed = header_len + len(stream)
-    pixels_have = np.prod(cover.shape[:2])
-    val.space_capacity(pixels_needed, pixels_have)
-    print(f'{pixels_needed}/{pixels_have} pixels used')
-
-    cover_plane = cover if cover.ndim < 3 else cover[...,COLOR_PLANE]
-    stego_plane = cover_plane.copy()
-    idx = permute_indices(cover_plane.shape, passwd=passwd, length=pixels_needed)
-
-    header_mask = 0xfe
-    header_idx = (idx[0][:header_len], idx[1][:header_len])
-    stego_plane[header_idx] = (stego_plane[header_idx] & header_mask) | header
-    idx = (idx[0][header_len:], idx[1][header_len:])
-    if lsb == 1:
-        stego_plane[idx] = (stego_plane[idx] & header_mask) | stream
+            frames = uio.imread(cover_file, frames=True, workers=workers)
+            val.frames_format(out_file, len(frames))
+            cover = _stack(frames)
+        record['bytes'] = cover.nbytes
+    if chunk_size is None:
+        with profile.stage('read') as record:
+            secret = uio.fread(secret_file)
+            record['bytes'] = len(secret)
+        info = embed_array(cover, secret, secret_file, lsb, passwd, compress, channels,
+                           profile=profile, block_size=block_size, workers=workers)
     else:
-        stream_mask = 256 - 2**lsb
-        stego_plane[idx] = (stego_plane[idx] & stream_mask) | stream
-        stego_plane[idx] = optimal_pixel_adj(stego_plane[idx], cover_plane[idx], lsb)
-    print(f'PSNR = {psnr(cover_plane, stego_plane):2.2f}')
+        with open(secret_file, 'rb') as f:
+            info = embed_array(cover, f, secret_file, lsb, passwd, compress, channels,
+                               chunk_size, profile, block_size, workers)
+    if verbose:
+        print(f'{info["pixels_used"]}/{info["pixels_have"]} pixels used')
+        print(f'PSNR = {info["psnr"]:2.2f}')
 
-    if cover.ndim < 3:
-        cover = stego_plane
-    else:
-        cover[...,COLOR_PLANE] = stego_plane
-    uio.imsave(cover, out_file)
+    with profile.stage('write', cover.nbytes):
+        if mmap:
+            cover.flush()
+        else:
+            uio.imsave(frames, out_file, save_profile, frames=True)
     
-def extract(stego_file, passwd='', extraction_dir=''):
+def update(stego_file, secret_file, passwd='', out_file=None, compress=None, mmap=False,
+           profile=None, verbose=True, save_profile='default'):
+    """
+    Replace the secret of a stego image without the cover, rewriting only the
+    pixels which change (see `update_array`).
+
+    Parameters
+    ----------
+    stego_file : str
+        Path to the stego file.
+    secret_file : str
+        Path to the new secret file.
+    out_file : None or str, optional
+        Destination of the updated stego file. If not defined, the stego file
+        is overwritten. Default is None.
+    mmap : bool, optional
+        Memory-map the stego file instead of decoding it, so that only the
+        pixels which hold the secret are read and only the changed pixels are
+        written, which makes the cost of an update of an uncompressed image
+        depend on the secret instead of the image. The stego file is modified
+        in place if `out_file` is not defined. Default is False.
+    compress : None, bool or str, optional
+        Compression of the new secret as described in `embed`. If not
+        defined, the codec of the existing secret is used. Default is None.
+        The rest of the parameters are described in `embed`.
+
+    Returns
+    -------
+    out : dict
+        The embedding info as described in `update_array`.
+    """
+    out_file = out_file or stego_file
+    val.file_format(out_file)
+    profile = Profile() if profile is None else profile
+    with profile.stage('read') as record:
+        if mmap:
+            val.same_format(stego_file, out_file)
+            stego = uio.immap(out_file, 'r+', source=stego_file)
+        else:
+            frames = uio.imread(stego_file, frames=True)
+            val.frames_format(out_file, len(frames))
+            stego = _stack(frames)
+        record['bytes'] = stego.nbytes
+    with profile.stage('read') as record:
+        secret = uio.fread(secret_file)
+        record['bytes'] = len(secret)
+    info = update_array(stego, secret, secret_file, passwd, compress, profile)
+    if verbose:
+        print(f'{info["pixels_changed"]} pixel values changed')
+        print(f'PSNR = {info["psnr"]:2.2f}')
+
+    with profile.stage('write', info['pixels_changed'] if mmap else stego.nbytes):
+        if mmap:
+            stego.flush()
+        else:
+            uio.imsave(frames, out_file, save_profile, frames=True)
+    return info
+
+def extract(stego_file, passwd='', extraction_dir='', chunk_size=None, mmap=False,
+            profile=None, verbose=True, workers=None):
     """
     Extract a secret embedded with the pixel LSB substitution algorithm.
 
@@ -106,7 +1178,33 @@ def extract(stego_file, passwd='', extraction_dir=''):
         program will exhibit undefined behaviour and will certainly crash,
         effectively failing to extract the secret. Default is empty string.
     extraction_dir : str, optional
-        Directory where the secret will be extracted.
+        Directory where the secret will be extracted. If not set, it will be
+        the directory of the stego file. Default is empty string.
+    chunk_size : None or int, optional
+        If set, the secret is extracted, decompressed and written in chunks of
+        approximately this many bytes, so that memory use depends on the chunk
+        size instead of the secret size. The chunks are written to a temporary
+        file, which only replaces the output file once the secret has been
+        verified. If not set, the whole secret is
+        extracted at once. A secret in a block container is extracted in
+        chunks of whole blocks, each of which is written as soon as its blocks
+        are verified. Default is None.
+    mmap : bool, optional
+        Memory-map the stego file instead of decoding it, so that only the
+        pixels which hold the secret are read. The stego file must be a .npy
+        file or an uncompressed single-frame image, e.g., TIFF or PPM/PGM.
+        Default is False.
+    profile : None or Profile, optional
+        If set, the duration and bytes processed of each stage are recorded in
+        it: 'read', 'header', 'permutation', 'packing', 'validation' (CRC),
+        'decompression' and 'write'. The path of the extracted secret is
+        recorded in its `info`. Default is None.
+    verbose : bool, optional
+        Print the path of the extracted secret. Default is True.
+    workers : None or int, optional
+        Number of threads the payload pixels of a large secret are read on,
+        in contiguous parts of the permuted pixels. If not defined, it will be
+        the number of CPUs. Default is None.
 
     Returns
     -------
@@ -116,29 +1214,41 @@ def extract(stego_file, passwd='', extraction_dir=''):
     --------
     embed : Embed secret. What this function reverses.
     """
-    stego = uio.imread(stego_file)
-    stego_plane = stego if stego.ndim < 3 else stego[...,COLOR_PLANE]
-    idx = permute_indices(stego_plane.shape, passwd=passwd)
-    
-    header_idx = (idx[0][:MAX_LENGTH], idx[1][:MAX_LENGTH])
-    bits = stego_plane[header_idx] & 0x01
-    header = decode(bits)
-    header_len = header['header_len']
-    lsb = header['lsb']
-    
-    mask = 2**lsb - 1
-    data_len = header['data_len']
-    bitlength = int(np.ceil(data_len * 8 / lsb))
-    idx = (idx[0][header_len:header_len+bitlength], idx[1][header_len:header_len+bitlength])
-    stream = stego_plane[idx] & mask
-    secret = bits2bytes(stream, lsb)[:data_len]
-    val.data_integrity(secret, header['crc'])
-    if header['compress']:
-        secret = inflate(secret)
-    directory = os.path.dirname(stego_file)
+    profile = Profile() if profile is None else profile
+    with profile.stage('read') as record:
+        if mmap:
+            stego = uio.immap(stego_file)
+        else:
+            stego = _stack(uio.imread(stego_file, writable=False, frames=True,
+                                      workers=workers))
+        record['bytes'] = stego.nbytes
+    header, scheme = _read_header(stego, passwd, profile)
+    if header['shards']:
+        raise ValueError(f'"{stego_file}" holds shard {header["shard"]} of {header["shards"]}, '
+                         'which are extracted together with `lsb_shards.extract`')
+    if not plausible(header, *_pixels(stego).shape):
+        raise ValueError('No secret was found. The password may be wrong.')
+    _check_payload(stego, header)
+
+    directory = extraction_dir or os.path.dirname(stego_file)
     out_file = os.path.join(directory, f'[extracted]{header["fname"]}')
-    uio.fsave(secret, out_file)
-    print(f'Secret extracted to "{out_file}"')
+    # The secret is written to a temporary file, which only replaces any
+    # existing output once it has been verified
+    temp_file = f'{out_file}.{os.getpid()}.part'
+    try:
+        with open(temp_file, 'wb') as f:
+            for data in _extract_chunks(stego, header, scheme, passwd, chunk_size, profile,
+                                        workers):
+                with profile.stage('write', len(data)):
+                    f.write(data)
+        os.replace(temp_file, out_file)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    profile.info['out_file'] = out_file
+    if verbose:
+        print(f'Secret extracted to "{out_file}"')
 
 
 if __name__ == '__main__':
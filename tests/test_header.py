@@ -0,0 +1,11 @@
+from utils.header import MAX_LENGTH, MAX_DATA_LEN, decode, encode_fields
+
+
+def test_max_length():
+    bits = encode_fields(MAX_DATA_LEN, 2**32 - 1, 'b' * 255, 8, 'pzlib-6', channels=(0, 1, 2, 3),
+                         fixed=True, block_size=2**26, shard=(255, 256, 2**32 - 1))
+    assert len(bits) == MAX_LENGTH
+    header = decode(bits)
+    assert header['header_len'] == MAX_LENGTH
+    assert (header['data_len'], header['fname'], header['shard'], header['shards'],
+            header['secret_crc']) == (MAX_DATA_LEN, 'b' * 255, 255, 256, 2**32 - 1)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from utils import kernels
+from utils.algorithms import lsb_substitute, optimal_pixel_adj
+from utils.binary import BitStream
+
+
+SIZES = (0, 1, 7, 8, 9, 1000, kernels.PARALLEL_SIZE + 5)
+
+def both(func):
+    """The output of `func` with each backend."""
+    outputs = []
+    for backend in kernels.BACKENDS:
+        with kernels.use(backend):
+            outputs.append(np.asarray(func()))
+    return outputs
+
+def assert_identical(func):
+    numpy_out, numba_out = both(func)
+    assert numpy_out.dtype == numba_out.dtype
+    np.testing.assert_array_equal(numpy_out, numba_out)
+
+@pytest.fixture(params=SIZES)
+def data(request):
+    rng = np.random.default_rng(request.param)
+    return (rng.integers(0, 256, request.param, dtype=np.uint8).tobytes(),
+            rng.integers(0, 256, request.param, dtype=np.uint8))
+
+@pytest.mark.parametrize('k', range(1, 9))
+def test_groups(data, k):
+    stream = BitStream(data[0])
+    n = stream.ngroups(k)
+    assert_identical(lambda: stream.groups(k))
+    # Ranges which don't start or end at a byte
+    assert_identical(lambda: stream.groups(k, min(3, n), max(n - 5, 0)))
+
+@pytest.mark.parametrize('k', range(1, 9))
+def test_from_groups(data, k):
+    stream = BitStream(data[0])
+    n = stream.ngroups(k)
+    bits = stream.groups(k)
+    assert_identical(lambda: BitStream.from_groups(bits, k).tobytes())
+    assert_identical(lambda: BitStream.from_groups(bits[min(3, n):max(n - 5, 0)], k).tobytes())
+
+@pytest.mark.parametrize('k', range(1, 9))
+def test_substitution(data, k):
+    secret, original = data
+    bits = BitStream(secret).groups(k)
+    pixels = original[:len(bits)]
+    modified = (pixels & (256 - 2**k)) | bits[:len(pixels)]
+    assert_identical(lambda: lsb_substitute(pixels, bits[:len(pixels)], k))
+    assert_identical(lambda: optimal_pixel_adj(modified, pixels, k))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import lsb_substitution
+from utils.indices import permute_indices
+import utils.io as uio
+
+
+def test_failed_extract_keeps_previous_output(tmp_path):
+    rng = np.random.default_rng(0)
+    uio.imsave(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8), str(tmp_path / 'cover.png'))
+    secret = rng.integers(0, 256, 2000, dtype=np.uint8).tobytes()
+    (tmp_path / 'secret.bin').write_bytes(secret)
+    lsb_substitution.embed(str(tmp_path / 'cover.png'), str(tmp_path / 'secret.bin'),
+                           str(tmp_path / 'stego.png'), lsb=4, passwd='pw', verbose=False)
+    lsb_substitution.extract(str(tmp_path / 'stego.png'), 'pw', verbose=False)
+    out_file = tmp_path / '[extracted]secret.bin'
+    assert out_file.read_bytes() == secret
+
+    # Corrupt the payload pixels only, so that the header is still read
+    stego = uio.imread(str(tmp_path / 'stego.png'))
+    header = lsb_substitution.probe(str(tmp_path / 'stego.png'), 'pw')
+    idx = permute_indices(stego.shape[:2], 'pw', 100, header['header_len'])
+    stego.reshape(-1, 3)[idx, 2] ^= 3
+    uio.imsave(stego, str(tmp_path / 'corrupt.png'))
+    for chunk_size in (None, 500):
+        with pytest.raises(ValueError, match='integrity'):
+            lsb_substitution.extract(str(tmp_path / 'corrupt.png'), 'pw',
+                                     chunk_size=chunk_size, verbose=False)
+        assert out_file.read_bytes() == secret
+    with pytest.raises(ValueError, match='password'):
+        lsb_substitution.extract(str(tmp_path / 'stego.png'), 'wrong', verbose=False)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        '[extracted]secret.bin', 'corrupt.png', 'cover.png', 'secret.bin', 'stego.png']
+
+def test_shard_with_longest_filename():
+    rng = np.random.default_rng(1)
+    cover = rng.integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    shard = rng.integers(0, 256, 1000, dtype=np.uint8).tobytes()
+    lsb_substitution.embed_shard(cover, shard, 'b' * 255, 2, 'pw', 'zlib-9', None, 3, 4,
+                                 secret_crc=12345)
+    out = lsb_substitution.extract_array(cover, 'pw')
+    assert (out['data'], out['fname']) == (shard, 'b' * 255)
+    assert (out['shard'], out['shards'], out['secret_crc']) == (3, 4, 12345)
+
+@pytest.mark.parametrize('secret', [(b'text data ' * 600)[:6000],
+                                    bytes(np.random.default_rng(2).integers(0, 16, 200_000,
+                                                                            dtype=np.uint8))],
+                         ids=['exact', 'sampled'])
+def test_plan_block_container(secret):
+    side = 20 if len(secret) < 10_000 else 400
+    cover = np.zeros((side, side, 3), dtype=np.uint8)
+    out = lsb_substitution.plan(secret, [cover], compress='zlib-9', block_size=4096)
+    assert out['lsb'] is not None
+    info = lsb_substitution.embed_array(cover, secret, lsb=out['lsb'], compress='zlib-9',
+                                        block_size=4096)
+    assert info['pixels_used'] <= out['header_len'] + -(-out['data_len'] * 8 // out['lsb'])
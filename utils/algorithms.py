@@ -1,5 +1,9 @@
+import functools
+
 import numpy as np
 
+from . import kernels
+
 
 def optimal_pixel_adj(modified, original, k):
     """
@@ -46,20 +50,91 @@ def optimal_pixel_adj(modified, original, k):
     >>> optimal_pixel_adj(p1, p0, lsb)
     array([159, 159], dtype=uint8)
     """
-    opa = []
+    if kernels.enabled():
+        return kernels.lookup(opa_table(k), original, modified, k)
+    payload = modified & (2**k - 1)
+    return opa_table(k)[original, payload]
+
+@functools.lru_cache(maxsize=None)
+def opa_table(k):
+    """
+    Lookup table of LSB substitution followed by OPA.
+
+    The stego value of a pixel only depends on its original value and the k-bit
+    payload, so the result for every combination is computed once per `k`.
+
+    Parameters
+    ----------
+    k : int
+        Value of least significant bits where embedding takes place.
+
+    Returns
+    -------
+    out : ndarray, uint8 type
+        Read-only array of shape (256, 2**k) with the stego value of each
+        (original pixel, payload) pair.
+
+    See also
+    --------
+    optimal_pixel_adj : The correction applied after substitution
+
+    Example
+    -------
+    >>> opa_table(3)[[157, 160], [7, 7]]
+    array([159, 159], dtype=uint8)
+    """
+    original = np.arange(256, dtype=np.int32)[:,None]
+    payload = np.arange(2**k, dtype=np.int32)
+    modified = (original & (256 - 2**k)) | payload
+    diff = modified - original
     inner = 2**(k-1)
     outer = 2**k
-    for i in range(-outer+1, outer):
-        if inner < i < outer:
-            opa.append(-outer)
-        elif -inner > i > -outer:
-            opa.append(outer)
-        else:
-            opa.append(0)
-    opa = np.array(opa)
-    diff = modified.astype(np.int32) - original
-    correction = opa[diff - outer]
-    c = modified + correction
-    correction[(c < 0) | (c > 255)] = 0
-    out = modified + correction
-    return out.astype(np.uint8)
+    adjusted = modified - outer * (diff > inner) + outer * (diff < -inner)
+    table = np.where((adjusted < 0) | (adjusted > 255), modified, adjusted)
+    table = table.astype(np.uint8)
+    table.setflags(write=False)
+    return table
+
+def lsb_substitute(original, stream, k, out=None):
+    """
+    Substitute the k least significant bits of pixels with a bit stream.
+
+    This works on the gathered target pixels only, so that an embedding
+    algorithm can gather them once from the cover, compute the stego values
+    and scatter them back once.
+
+    Parameters
+    ----------
+    original : ndarray
+        Original pixels of uint8 type.
+    stream : ndarray
+        The k-bit groups to embed, one per pixel, of uint8 type.
+    k : int
+        Value of least significant bits where embedding takes place. For k > 1
+        the result is corrected with the Optimal Pixel Adjustment method.
+    out : None or ndarray, optional
+        Array of uint8 type where the result is stored. Default is None.
+
+    Returns
+    -------
+    out : ndarray, uint8 type
+        The stego pixels.
+
+    See also
+    --------
+    opa_table : The lookup table which computes the result
+
+    Example
+    -------
+    >>> p0 = np.array([157, 160], dtype=np.uint8)
+    >>> stream = np.array([7, 7], dtype=np.uint8)
+    >>> lsb_substitute(p0, stream, 3)
+    array([159, 159], dtype=uint8)
+    """
+    if kernels.enabled():
+        return kernels.lookup(opa_table(k), original, stream, k, out)
+    # Flat index of the (original, stream) pair in the table, which fits in
+    # 16 bits and avoids any wider intermediate
+    idx = original.astype(np.uint16) << k
+    idx |= stream
+    return np.take(opa_table(k).reshape(-1), idx, out=out)
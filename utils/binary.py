@@ -1,5 +1,7 @@
 import numpy as np
 
+from . import kernels
+
 
 # We work with little-endian order because we rely on `np.packbits` under the
 # hood and bit arrays shorter than 8 bits are tail padded with zeroes. For
@@ -7,6 +9,143 @@ import numpy as np
 # In little endian this works as intended, because 11001 becomes 11001000.
 ORDER = 'little'
 
+def _layout(k):
+    """
+    Locate each k-bit group within a block of k bytes.
+
+    Every k bytes hold exactly 8 groups, so the same layout repeats for all
+    blocks. Each group starts at byte `b` with bit offset `o` and spills over
+    to byte `b+1` if `o + k > 8`.
+    """
+    return [divmod(j*k, 8) for j in range(8)]
+
+class BitStream:
+    """
+    A bytestream viewed as a sequence of k-bit groups.
+
+    The bytes are wrapped without copying and the groups are computed with
+    bitwise operations on whole bytes, so there is no intermediate array with
+    one element per bit.
+
+    Parameters
+    ----------
+    data : bytes-like object
+        Input bytestream, e.g., bytes, bytearray, memoryview or uint8 ndarray.
+    bitorder : {'little', 'big'}, optional
+        Bit order within each byte. Groups of more than 1 bit are only
+        supported in little-endian order. Default is 'little'.
+
+    Examples
+    --------
+    >>> stream = BitStream(bytes([176, 34])) # in little endian 00001101, 01000100
+    >>> len(stream)
+    16
+    >>> stream.groups(3) # 000, 011, 010, 100, 010, 000
+    array([0, 6, 2, 1, 2, 0], dtype=uint8)
+    >>> stream.groups(3, 1, 4)
+    array([6, 2, 1], dtype=uint8)
+    >>> BitStream.from_groups(stream.groups(3), 3).tobytes()
+    b'\xb0"\x00'
+    """
+    def __init__(self, data, bitorder=ORDER):
+        self.data = np.frombuffer(data, dtype=np.uint8)
+        self.bitorder = bitorder
+
+    def __len__(self):
+        return 8 * len(self.data)
+
+    def ngroups(self, k):
+        """Number of k-bit groups, with the last one padded if necessary."""
+        return -(-len(self) // k)
+
+    def groups(self, k, start=0, stop=None):
+        """
+        Split the bytestream to k-bit groups.
+
+        Parameters
+        ----------
+        k : int
+            The number of bits per group, in the range [1, 8].
+        start : int, optional
+            Index of the first group to output. Default is 0.
+        stop : None or int, optional
+            Index where the output stops. If not defined, all groups until the
+            end are output. If the last group doesn't have enough bits, it is
+            padded with zeroes. Default is None.
+
+        Returns
+        -------
+        ndarray, uint8 type
+            Array with the groups [start, stop).
+        """
+        stop = self.ngroups(k) if stop is None else min(stop, self.ngroups(k))
+        if k == 1:
+            return np.unpackbits(self.data[start//8:-(-stop//8)],
+                                 bitorder=self.bitorder)[start%8:start%8+stop-start]
+        if self.bitorder != ORDER:
+            raise ValueError(f'Groups of {k} bits require little-endian order')
+        if kernels.enabled() and k < 8:
+            return kernels.groups(self.data, k, start, stop)
+        # Only the blocks which contain the requested groups are processed and
+        # the last one is padded with zeroes if it's incomplete
+        first, last = start // 8, -(-stop // 8)
+        blocks = self.data[first*k:last*k]
+        if len(blocks) < (last-first) * k:
+            padding = np.zeros(((last-first)*k - len(blocks),), dtype=np.uint8)
+            blocks = np.concatenate([blocks, padding])
+        blocks = blocks.reshape((last-first, k))
+        out = np.empty((last-first, 8), dtype=np.uint8)
+        mask = np.uint8(2**k - 1)
+        for j, (b, o) in enumerate(_layout(k)):
+            group = blocks[:,b] >> o
+            if o + k > 8:
+                group |= blocks[:,b+1] << (8-o)
+            out[:,j] = group & mask
+        return out.reshape(-1)[start-8*first:stop-8*first]
+
+    @classmethod
+    def from_groups(cls, groups, k, bitorder=ORDER):
+        """
+        Combine k-bit groups to a bytestream.
+
+        Parameters
+        ----------
+        groups : ndarray, uint8 type
+            1-D array of k-bit groups. The values must not exceed k bits.
+        k : int
+            The number of bits per group, in the range [1, 8].
+        bitorder : {'little', 'big'}, optional
+            Bit order within each byte. Groups of more than 1 bit are only
+            supported in little-endian order. Default is 'little'.
+
+        Returns
+        -------
+        BitStream
+            The resultant bytestream. If the last byte doesn't have enough
+            bits, it is padded with zeroes.
+        """
+        if k == 1:
+            return cls(np.packbits(groups, bitorder=bitorder), bitorder)
+        if bitorder != ORDER:
+            raise ValueError(f'Groups of {k} bits require little-endian order')
+        if kernels.enabled() and k < 8:
+            return cls(kernels.from_groups(groups, k), bitorder)
+        length = -(-len(groups) * k // 8)
+        pad = -len(groups) % 8
+        if pad:
+            groups = np.concatenate([groups, np.zeros((pad,), dtype=np.uint8)])
+        groups = groups.reshape((-1, 8))
+        blocks = np.zeros((len(groups), k), dtype=np.uint8)
+        for j, (b, o) in enumerate(_layout(k)):
+            blocks[:,b] |= groups[:,j] << o
+            if o + k > 8:
+                blocks[:,b+1] |= groups[:,j] >> (8-o)
+        return cls(blocks.reshape(-1)[:length], bitorder)
+
+    def tobytes(self):
+        """Copy the bytestream to a bytes object."""
+        return self.data.tobytes()
+
 def bits2bytes(bits, group=1):
     """
     Combine bit groups to bytes.
@@ -31,6 +170,7 @@ def bits2bytes(bits, group=1):
     See also
     --------
     bytes2bits : The opposite operation
+    BitStream.from_groups : The same operation without copying to bytes
 
     Examples
     --------
@@ -42,11 +182,7 @@ def bits2bytes(bits, group=1):
     >>> bits2bytes(bits, 3) # little endian of 00111001, 10000000
     b'\x9c\x01'
     """
-    length = len(bits) // group
-    if group > 1:
-        bits = np.unpackbits(bits[:,None], axis=1, bitorder=ORDER)
-        bits = bits[:,:group].flatten()
-    return bytes(np.packbits(bits, bitorder=ORDER))
+    return BitStream.from_groups(bits, group).tobytes()
 
 def bytes2bits(bytestream, group=1):
     """
@@ -68,6 +204,7 @@ def bytes2bits(bytestream, group=1):
     See also
     --------
     bits2bytes : The opposite operation
+    BitStream.groups : The same operation for a range of groups
 
     Examples
     --------
@@ -79,14 +216,7 @@ def bytes2bits(bytestream, group=1):
     >>> bytes2bits(value, 3) # 000, 011, 010, 100, 010, 000
     array([0, 6, 2, 1, 2, 0], dtype=uint8)
     """
-    bits = np.unpackbits(np.array(list(bytestream), dtype=np.uint8), bitorder=ORDER)
-    if group == 1:
-        return bits
-    pad = len(bits) % group
-    if pad:
-        bits = np.concatenate([bits, np.zeros((group-pad,), dtype=np.uint8)])
-    bits = bits.reshape((bits.shape[0]//group, group))
-    return np.squeeze(np.packbits(bits, axis=1, bitorder=ORDER))
+    return BitStream(bytestream).groups(group)
 
 def packbits(bits):
     """
@@ -114,7 +244,7 @@ def packbits(bits):
     n = np.packbits(bits, bitorder=ORDER)
     if len(n) > 1:
         n = n << np.arange(0, 8*len(n), 8, dtype=np.uint32)
-    return n.sum()
+    return int(n.sum())
 
 def unpackbits(n, length=None):
     """
@@ -126,8 +256,8 @@ def unpackbits(n, length=None):
         Input number, treated as 32-bit unsigned.
     length : int, optional
         The number of bits to show. If not defined, it will calculate the
-        minimum number of bits required. Can be used to pad the bitstream
-        to a desired length.
+        minimum number of bits required, which is 1 for zero. Can be used to
+        pad the bitstream to a desired length.
 
     Returns
     -------
@@ -142,6 +272,6 @@ def unpackbits(n, length=None):
     array([1, 1, 1, 1, 0, 1, 0, 1, 1, 0, 0, 0, 1], dtype=uint8)
     """
     if length is None:
-        length = int(np.floor(np.log2(n) + 1))
+        length = max(int(n).bit_length(), 1)
     bits = np.unpackbits(np.array([n], dtype=np.uint32).view(np.uint8), bitorder=ORDER)
     return bits[:length]
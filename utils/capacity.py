@@ -0,0 +1,159 @@
+import numpy as np
+
+
+# LSB values a secret can be embedded in
+LSBS = np.arange(1, 9)
+
+def substitution_error(lsb):
+    """
+    Expected square error of a pixel value with `lsb` bits substituted.
+
+    For random secret bits, the difference of the stego value from the cover
+    value is uniform over the 2**lsb residues, and OPA maps it to the range
+    (-2**(lsb-1), 2**(lsb-1)]. This is exact away from the clipped values 0
+    and 255.
+
+    Examples
+    --------
+    >>> substitution_error(1)
+    0.5
+    """
+    return (4.**np.asarray(lsb) + 2) / 12
+
+def pixels_needed(data_len, header_len, lsb, channels=1):
+    """
+    Number of pixels used to embed `data_len` bytes in `lsb` bits of
+    `channels` channels per pixel, after a header of `header_len` pixels.
+
+    This is the same as 'pixels_used' of the embedding, and it works on
+    arrays of any of the parameters.
+    """
+    groups = -(-8 * np.asarray(data_len, dtype=np.int64) // lsb)
+    return header_len + -(-groups // channels)
+
+def expected_mse(data_len, header_len, lsb, size):
+    """
+    Expected mean square error of embedding `data_len` bytes in `lsb` bits,
+    and a header of `header_len` bits in 1 bit, of an image with `size` pixel
+    values. It works on arrays of any of the parameters.
+    """
+    groups = -(-8 * np.asarray(data_len, dtype=np.int64) // lsb)
+    return (groups * substitution_error(lsb) + header_len * substitution_error(1)) / size
+
+def plan(data_len, header_len, pixels, channels=1, size=None, a_max=255):
+    """
+    Find the LSB value of least distortion for each cover of a pool, and the
+    cover of least distortion overall.
+
+    The pixels needed and the expected distortion of every (cover, LSB) pair
+    are computed at once. For a given cover, the distortion per embedded bit
+    grows with the LSB value, so the least distortion is at the minimal LSB
+    value which fits the secret.
+
+    Parameters
+    ----------
+    data_len : int
+        The bytestream length of the secret.
+    header_len : int
+        The length of the header in bits.
+    pixels : array_like of int
+        The number of pixels of each cover. Covers which can't be used, e.g.,
+        which don't have the embedding channels, can be given 0 pixels.
+    channels : int or array_like of int, optional
+        The number of channels per pixel of each cover the secret is embedded
+        in. Default is 1.
+    size : None or array_like of int, optional
+        The number of pixel values of each cover the PSNR is computed over. If
+        not defined, it will be `pixels * channels`. Default is None.
+    a_max : int, optional
+        Maximum pixel value. Default is 255.
+
+    Returns
+    -------
+    out : dict
+        - 'lsb': The minimal LSB value of each cover, or 0 if the secret
+                 doesn't fit in it.
+        - 'pixels_needed': The number of pixels used by each cover at that
+                           LSB value, or at 8 bits if it doesn't fit.
+        - 'psnr': The expected PSNR of each cover, or NaN if it doesn't fit.
+        - 'best': The index of the cover with the highest expected PSNR, and
+                  the lowest LSB value among equals, or None if the secret
+                  doesn't fit in any cover.
+    """
+    pixels = np.atleast_1d(np.asarray(pixels, dtype=np.int64))
+    channels = np.broadcast_to(np.asarray(channels, dtype=np.int64), pixels.shape)
+    size = pixels * channels if size is None else np.broadcast_to(size, pixels.shape)
+    # (cover, LSB) grid
+    needed = pixels_needed(data_len, header_len, LSBS, channels[:,None])
+    fits = (needed <= pixels[:,None]) & (pixels[:,None] > 0)
+    col = np.where(fits.any(axis=1), fits.argmax(axis=1), len(LSBS) - 1)
+    rows = np.arange(len(pixels))
+    lsb = np.where(fits[rows,col], LSBS[col], 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mse = expected_mse(data_len, header_len, LSBS[col], size)
+        psnr = np.where(lsb > 0, 10 * np.log10(a_max**2 / mse), np.nan)
+    best = None
+    if lsb.any():
+        # Highest PSNR first, then lowest LSB value and first cover
+        order = np.lexsort((rows, lsb, -np.nan_to_num(psnr, nan=-np.inf)))
+        best = int(order[0])
+    return {'lsb': lsb, 'pixels_needed': needed[rows,col], 'psnr': psnr, 'best': best}
+
+def payload_capacity(pixels, header_len, lsb, channels=1):
+    """
+    Maximum number of bytes which can be embedded in `lsb` bits of `channels`
+    channels per pixel of `pixels` pixels, after a header of `header_len`
+    pixels. It works on arrays of any of the parameters.
+    """
+    return np.maximum(np.asarray(pixels, dtype=np.int64) - header_len, 0) * channels * lsb // 8
+
+def shard_sizes(data_len, capacities):
+    """
+    Split a secret into shards in proportion to the capacity of each cover.
+
+    Every cover is filled to the same fraction of its capacity, which
+    spreads the distortion evenly and balances the work of the covers. The
+    bytes left over by rounding go to the covers with the largest remainders.
+    Every shard holds at least a byte, so that no cover is left without a
+    shard to reassemble.
+
+    Parameters
+    ----------
+    data_len : int
+        The bytestream length of the secret. It must not exceed the total
+        capacity, nor be less than the number of covers.
+    capacities : array_like of int
+        The capacity of each cover in bytes, e.g., from `payload_capacity`.
+
+    Returns
+    -------
+    ndarray, int64 type
+        The length of each shard, which is within the capacity of its cover.
+
+    Examples
+    --------
+    >>> shard_sizes(10, [10, 5, 5])
+    array([5, 3, 2])
+    """
+    capacities = np.asarray(capacities, dtype=np.int64)
+    total = int(capacities.sum())
+    if data_len > total:
+        raise ValueError(f'Secret of {data_len} bytes exceeds the capacity of {total} bytes')
+    if data_len < len(capacities):
+        raise ValueError(f'Secret of {data_len} bytes is too short to be split across '
+                         f'{len(capacities)} covers')
+    if (capacities <= 0).any():
+        raise ValueError(f'Covers {np.flatnonzero(capacities <= 0).tolist()} are too small to '
+                         'hold a shard')
+    # A byte is given to each cover first, and the rest is split in proportion
+    # to the capacity left
+    spare, rest = capacities - 1, data_len - len(capacities)
+    total = int(spare.sum())
+    sizes = np.ones_like(capacities)
+    if total:
+        sizes += spare * rest // total
+        remainders = spare * rest % total
+        # Stable order, so that ties go to the first covers
+        extra = np.argsort(-remainders, kind='stable')[:data_len - int(sizes.sum())]
+        sizes[extra] += 1
+    return sizes
@@ -1,16 +1,346 @@
+import bz2
+import functools
+import lzma
+import os
 import zlib
 
+import numpy as np
 
-def deflate(data):
+from .parallel import thread_map
+
+
+# Byte entropy in bits per byte, above which a secret is considered not worth
+# compressing, e.g., an image, archive or encrypted file.
+ENTROPY_THRESHOLD = 7.8
+# Codecs are selected on a sample of blocks spread evenly across the secret
+SAMPLES = 16
+SAMPLE_SIZE = 4096
+# Candidates of the automatic selection
+AUTO_CODECS = ('zlib-9', 'bz2', 'lzma')
+# The block size of bz2 level 1, and the smallest dictionary of lzma, which
+# bound the buffers of their trial on a sample
+BZ2_BLOCK_SIZE = 100_000 - 19
+LZMA_MIN_DICT_SIZE = 4096
+# Size of the independently compressed blocks of the 'pzlib' codecs. Each
+# block is stored after its compressed size as a 4-byte little-endian integer.
+BLOCK_SIZE = 2**20
+
+def deflater(level=9):
+    """Incremental compressor of a bytestream with the Deflate algorithm."""
+    return zlib.compressobj(level=level, wbits=-zlib.MAX_WBITS)
+
+def inflater():
+    """Incremental decompressor of a bytestream compressed with `deflater`."""
+    return zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+
+def deflate(data, level=9):
     """Compress a bytestream with the Deflate algorithm."""
-    compress = zlib.compressobj(level=9, wbits=-zlib.MAX_WBITS)
+    compress = deflater(level)
     deflated = compress.compress(data)
     deflated += compress.flush()
     return deflated
 
 def inflate(data):
     """Uncompress a bytestream compressed with the Deflate algorithm."""
-    decompress = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+    decompress = inflater()
     inflated = decompress.decompress(data)
     inflated += decompress.flush()
     return inflated
+
+class _Store:
+    """Incremental (de)compressor which leaves the bytestream as is."""
+    def compress(self, data):
+        return bytes(data)
+
+    decompress = compress
+
+    def flush(self):
+        return b''
+
+class _BlockCompressor:
+    """
+    Incremental compressor of independent Deflate blocks on a thread pool.
+
+    zlib releases the GIL while compressing, so the blocks are compressed in
+    parallel. All the full blocks of each input are compressed at once, and
+    the last partial block on `flush`.
+    """
+    def __init__(self, level=9, block_size=BLOCK_SIZE, workers=None):
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers
+        self.pending = bytearray()
+
+    def _compress(self, blocks):
+        out = bytearray()
+        deflate_block = functools.partial(deflate, level=self.level)
+        for deflated in thread_map(deflate_block, blocks, workers=self.workers):
+            out += len(deflated).to_bytes(4, 'little')
+            out += deflated
+        return bytes(out)
+
+    def compress(self, data):
+        data = memoryview(data).cast('B')
+        blocks = []
+        if self.pending:
+            fill = self.block_size - len(self.pending)
+            self.pending += data[:fill]
+            data = data[fill:]
+            if len(self.pending) == self.block_size:
+                blocks.append(bytes(self.pending))
+                self.pending = bytearray()
+        full = len(data) - len(data) % self.block_size
+        blocks += [data[i:i+self.block_size] for i in range(0, full, self.block_size)]
+        self.pending += data[full:]
+        return self._compress(blocks)
+
+    def flush(self):
+        out = self._compress([bytes(self.pending)] if self.pending else [])
+        self.pending = bytearray()
+        return out
+
+class _BlockDecompressor:
+    """Incremental decompressor of the blocks of `_BlockCompressor` on a thread pool."""
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.pending = bytearray()
+
+    def decompress(self, data):
+        data = memoryview(data).cast('B')
+        if self.pending:
+            self.pending += data
+            data = memoryview(self.pending)
+        blocks, start = [], 0
+        while len(data) - start >= 4:
+            size = int.from_bytes(data[start:start+4], 'little')
+            if len(data) - start - 4 < size:
+                break
+            blocks.append(data[start+4:start+4+size])
+            start += 4 + size
+        self.pending = bytearray(data[start:])
+        return b''.join(thread_map(inflate, blocks, workers=self.workers))
+
+    def flush(self):
+        if self.pending:
+            raise ValueError('Compressed data ends with an incomplete block')
+        return b''
+
+class _Flushing:
+    """Add a `flush` method to decompressors which don't need one."""
+    def __init__(self, decompressor):
+        self.decompressor = decompressor
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return b''
+
+class Codec:
+    """
+    A compression algorithm, which is recorded in the header by its id.
+
+    Parameters
+    ----------
+    name : str
+        Name of the codec, e.g., 'zlib-9'.
+    id : int
+        Id of the codec in the header, in the range [0, 15].
+    compressor : callable
+        Returns an incremental compressor with `compress` and `flush` methods.
+    decompressor : callable
+        Returns an incremental decompressor with `decompress` and `flush`
+        methods.
+    """
+    def __init__(self, name, id, compressor, decompressor):
+        self.name = name
+        self.id = id
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+    def __repr__(self):
+        return f'Codec({self.name!r}, {self.id})'
+
+    def compress(self, data):
+        """Compress a whole bytestream."""
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """Uncompress a whole bytestream."""
+        decompressor = self.decompressor()
+        return decompressor.decompress(data) + decompressor.flush()
+
+CODECS = {}
+
+def register(codec):
+    """Add a codec to the registry, so that it can be embedded and extracted."""
+    if not 0 <= codec.id < 16:
+        raise ValueError(f'Codec id must be within [0, 15], but got {codec.id}')
+    if any(c.id == codec.id for c in CODECS.values() if c.name != codec.name):
+        raise ValueError(f'Codec id {codec.id} is already registered')
+    CODECS[codec.name] = codec
+    return codec
+
+def get_codec(key):
+    """Find a registered codec by its name or id."""
+    for codec in CODECS.values():
+        if key in (codec.name, codec.id) and not isinstance(key, bool):
+            return codec
+    raise ValueError(f'Unknown compression codec "{key}"')
+
+# LZMA2 without the .xz container, the same as Deflate without zlib's
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6}]
+
+register(Codec('store', 0, _Store, _Store))
+# Raw Deflate streams. 'zlib-9' has the id 1, which is the same as the
+# compression bit of older headers.
+register(Codec('zlib-9', 1, lambda: deflater(9), inflater))
+register(Codec('zlib-1', 2, lambda: deflater(1), inflater))
+register(Codec('zlib-6', 3, lambda: deflater(6), inflater))
+register(Codec('bz2', 4, lambda: bz2.BZ2Compressor(9),
+               lambda: _Flushing(bz2.BZ2Decompressor())))
+register(Codec('lzma', 5, lambda: lzma.LZMACompressor(lzma.FORMAT_RAW, filters=_LZMA_FILTERS),
+               lambda: _Flushing(lzma.LZMADecompressor(lzma.FORMAT_RAW,
+                                                       filters=_LZMA_FILTERS))))
+# Independent blocks of raw Deflate streams, which are compressed and
+# decompressed in parallel
+register(Codec('pzlib-9', 6, lambda: _BlockCompressor(9), _BlockDecompressor))
+register(Codec('pzlib-6', 7, lambda: _BlockCompressor(6), _BlockDecompressor))
+
+def deflate_blocks(data, level=9, block_size=BLOCK_SIZE, workers=None):
+    """
+    Compress a bytestream in independent blocks with the Deflate algorithm on
+    the shared thread pool, with at most `workers` blocks at a time, or as many
+    as the CPUs.
+    """
+    compress = _BlockCompressor(level, block_size, workers)
+    return compress.compress(data) + compress.flush()
+
+def inflate_blocks(data, workers=None):
+    """Uncompress a bytestream compressed with `deflate_blocks` on a thread pool."""
+    decompress = _BlockDecompressor(workers)
+    return decompress.decompress(data) + decompress.flush()
+
+def sample(data, samples=SAMPLES, size=SAMPLE_SIZE):
+    """Blocks of `size` bytes spread evenly across a bytestream."""
+    data = memoryview(data).cast('B')
+    if len(data) <= samples * size:
+        return bytes(data)
+    step = (len(data) - size) // (samples - 1)
+    return b''.join(data[i*step:i*step+size] for i in range(samples))
+
+def entropy(data, corrected=False):
+    """
+    Shannon entropy of the byte values of a bytestream in bits per byte.
+
+    With `corrected`, the Miller-Madow correction is added, because the entropy
+    of a small sample underestimates the entropy of the whole bytestream, e.g.,
+    about 7.8 bits per byte for 1 KB of random bytes.
+
+    Examples
+    --------
+    >>> entropy(b'aaaa')
+    0.0
+    >>> entropy(bytes(range(256)))
+    8.0
+    """
+    if not len(data):
+        return 0.
+    counts = np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+    p = counts[counts > 0] / len(data)
+    h = float((p * np.log2(1 / p)).sum())
+    if corrected:
+        h += (len(p) - 1) / (2 * len(data) * np.log(2))
+    return h
+
+def _trial_size(name, data):
+    """
+    Compressed size of a sample with a codec of `AUTO_CODECS`.
+
+    bz2 and lzma are run with the smallest block and dictionary which hold the
+    sample. The size is the same as with their registered settings, but the
+    buffers of those, e.g., the 94 MB dictionary of lzma preset 6, aren't
+    allocated for a sample of 64 KB.
+    """
+    if name == 'bz2' and len(data) < BZ2_BLOCK_SIZE:
+        return len(bz2.compress(data, 1))
+    if name == 'lzma':
+        filters = [dict(_LZMA_FILTERS[0], dict_size=max(len(data), LZMA_MIN_DICT_SIZE))]
+        return len(lzma.compress(data, lzma.FORMAT_RAW, filters=filters))
+    return len(get_codec(name).compress(data))
+
+def select_codec(compress, data, threshold=ENTROPY_THRESHOLD):
+    """
+    Select the codec of a secret from a sample of it.
+
+    The whole secret is never compressed for the selection. If the entropy of
+    the sample shows that it's not worth compressing, the 'store' codec is
+    selected.
+
+    Parameters
+    ----------
+    compress : bool or str
+        'auto' or True selects the codec of `AUTO_CODECS` which compresses the
+        sample the most. If that is 'zlib-9' and the secret has several blocks,
+        'pzlib-9' is selected instead on multi-core machines. A codec name
+        selects that codec, and False or 'store' selects no compression.
+    data : bytes-like object
+        The secret, or the part of it that is available, e.g., its first chunk.
+    threshold : float, optional
+        Entropy in bits per byte, above which no compression is selected.
+        Default is `ENTROPY_THRESHOLD`.
+
+    Returns
+    -------
+    Codec
+        The selected codec.
+    """
+    store = CODECS['store']
+    if compress is False:
+        return store
+    codec = None if compress is True or compress == 'auto' else get_codec(compress)
+    if codec is store:
+        return store
+    length = len(memoryview(data).cast('B'))
+    data = sample(data)
+    if entropy(data, corrected=True) >= threshold:
+        return store
+    if codec is None:
+        sizes = [(_trial_size(name, data), name) for name in AUTO_CODECS]
+        size, name = min(sizes)
+        if name == 'zlib-9' and length >= 2 * BLOCK_SIZE and (os.cpu_count() or 1) > 1:
+            name = 'pzlib-9'
+        codec = get_codec(name) if size < len(data) else store
+    return codec
+
+def estimate_size(compress, data, threshold=ENTROPY_THRESHOLD, block_size=None):
+    """
+    Estimate the compressed size of a secret from a sample of it.
+
+    The codec is selected with `select_codec`, and the compression ratio of
+    the sample is applied to the whole secret. A secret which fits in the
+    sample is compressed whole, so its size is exact. With `block_size`, the
+    sample is compressed in independent blocks of that size, as in a block
+    container (see `utils.container`), without the index.
+
+    Returns
+    -------
+    codec : Codec
+        The selected codec.
+    size : int
+        The estimated size of the compressed secret. It's never larger than
+        the secret, which is embedded uncompressed in that case.
+    exact : bool
+        Whether `size` is the exact compressed size.
+    """
+    codec = select_codec(compress, data, threshold)
+    length = len(memoryview(data).cast('B'))
+    if not codec.id:
+        return codec, length, True
+    data = sample(data)
+    step = block_size or max(len(data), 1)
+    size = sum(_trial_size(codec.name, data[i:i+step]) for i in range(0, len(data), step))
+    if len(data) == length:
+        return (codec, size, True) if size < length else (CODECS['store'], length, True)
+    return codec, min(-(-size * length // len(data)), length), False
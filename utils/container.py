@@ -0,0 +1,182 @@
+import zlib
+
+import numpy as np
+
+from .parallel import thread_map
+
+
+# The block container splits the secret into blocks of a fixed size, which are
+# compressed independently and stored one after the other, followed by the
+# index:
+#   table: for each block, its stored size and the CRC-32 of its stored bytes,
+#          as 4-byte little-endian integers
+#   trailer: the length of the secret as an 8-byte little-endian integer
+# The index is at the end so that the blocks can be embedded as they're
+# compressed. Its CRC-32 is the checksum of the header.
+ENTRY_SIZE = 8
+TRAILER_SIZE = 8
+# Block sizes are powers of 2 in [4 KiB, 64 MiB], which are stored as a 4-bit
+# header field of log2(block_size) - 11. 0 marks a plain payload.
+MIN_BLOCK_BITS = 12
+MAX_BLOCK_BITS = 26
+
+def block_field(block_size):
+    """
+    The header field of a block size, or 0 for a plain payload.
+
+    Examples
+    --------
+    >>> block_field(2**20)
+    9
+    """
+    if block_size is None:
+        return 0
+    bits = int(block_size).bit_length() - 1
+    if block_size != 2**bits or not MIN_BLOCK_BITS <= bits <= MAX_BLOCK_BITS:
+        raise ValueError(f'Block size must be a power of 2 within '
+                         f'[{2**MIN_BLOCK_BITS}, {2**MAX_BLOCK_BITS}], but got {block_size}')
+    return bits - MIN_BLOCK_BITS + 1
+
+def block_size_from_field(field):
+    """The block size of a header field, or None for a plain payload."""
+    return 2**(field + MIN_BLOCK_BITS - 1) if field else None
+
+def nblocks(raw_len, block_size):
+    """Number of blocks of a secret."""
+    return -(-raw_len // block_size)
+
+def index_size(raw_len, block_size):
+    """Length of the index of a secret in bytes."""
+    return nblocks(raw_len, block_size) * ENTRY_SIZE + TRAILER_SIZE
+
+class BlockWriter:
+    """
+    Incremental writer of the block container, with the same interface as
+    the compressors of `utils.compression.Codec`.
+
+    All the full blocks of each input are compressed at once on a thread
+    pool, and the last partial block and the index on `flush`.
+
+    Parameters
+    ----------
+    codec : Codec
+        The codec which compresses each block.
+    block_size : int
+        Length of the blocks of the secret, before compression.
+    workers : None or int, optional
+        Number of threads. If not defined, it will be the number of CPUs.
+        Default is None.
+    """
+    def __init__(self, codec, block_size, workers=None):
+        block_field(block_size)
+        self.codec = codec
+        self.block_size = block_size
+        self.workers = workers
+        self.pending = bytearray()
+        self.table = bytearray()
+        self.raw_len = 0
+        self.index = None
+
+    def _compress(self, blocks):
+        out = bytearray()
+        compress = self.codec.compress if self.codec.id else bytes
+        for stored in thread_map(compress, blocks, workers=self.workers):
+            self.table += len(stored).to_bytes(4, 'little')
+            self.table += zlib.crc32(stored).to_bytes(4, 'little')
+            out += stored
+        return bytes(out)
+
+    def compress(self, data):
+        data = memoryview(data).cast('B')
+        self.raw_len += len(data)
+        blocks = []
+        if self.pending:
+            fill = self.block_size - len(self.pending)
+            self.pending += data[:fill]
+            data = data[fill:]
+            if len(self.pending) == self.block_size:
+                blocks.append(bytes(self.pending))
+                self.pending = bytearray()
+        full = len(data) - len(data) % self.block_size
+        blocks += [data[i:i+self.block_size] for i in range(0, full, self.block_size)]
+        self.pending += data[full:]
+        return self._compress(blocks)
+
+    def flush(self):
+        out = self._compress([bytes(self.pending)] if self.pending else [])
+        self.pending = bytearray()
+        self.index = bytes(self.table) + self.raw_len.to_bytes(TRAILER_SIZE, 'little')
+        return out + self.index
+
+def pack(data, codec, block_size, workers=None):
+    """
+    Split a secret into a block container.
+
+    Returns
+    -------
+    payload : bytes
+        The compressed blocks followed by the index.
+    index : bytes
+        The index, whose CRC-32 is the checksum of the header.
+    """
+    writer = BlockWriter(codec, block_size, workers)
+    payload = writer.compress(data) + writer.flush()
+    return payload, writer.index
+
+class Index:
+    """
+    The index of a block container.
+
+    Parameters
+    ----------
+    data : bytes-like object
+        The index, i.e., the last `index_size` bytes of the payload.
+    block_size : int
+        Length of the blocks of the secret, before compression.
+
+    Attributes
+    ----------
+    raw_len : int
+        Length of the secret.
+    sizes, crcs : ndarray, int64 type
+        The stored size and CRC-32 of each block.
+    offsets : ndarray, int64 type
+        Where each block starts in the payload, and where the last one ends.
+    """
+    def __init__(self, data, block_size):
+        data = memoryview(data).cast('B')
+        self.block_size = block_size
+        self.raw_len = int.from_bytes(data[-TRAILER_SIZE:], 'little')
+        if len(data) != index_size(self.raw_len, block_size):
+            raise ValueError('Block index is corrupted.')
+        table = np.frombuffer(data[:-TRAILER_SIZE], dtype='<u4').reshape(-1, 2).astype(np.int64)
+        self.sizes, self.crcs = table[:,0], table[:,1]
+        self.offsets = np.concatenate([[0], np.cumsum(self.sizes)])
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def blocks(self, start, stop):
+        """The range [first, last) of blocks which hold the bytes [start, stop) of the secret."""
+        if start >= stop:
+            return 0, 0
+        return start // self.block_size, -(-stop // self.block_size)
+
+def split(stored, index, first, last):
+    """Views of the blocks [first, last) in their stored bytes."""
+    stored = memoryview(stored).cast('B')
+    offsets = index.offsets[first:last+1] - index.offsets[first]
+    return [stored[offsets[i]:offsets[i+1]] for i in range(last - first)]
+
+def verify(blocks, index, first, workers=None):
+    """Check the CRC-32 of each block on a thread pool, starting from block `first`."""
+    crcs = thread_map(zlib.crc32, blocks, workers=workers)
+    for i, crc in enumerate(crcs, first):
+        if crc != index.crcs[i]:
+            raise ValueError(f'Data integrity of block {i} not verified.')
+
+def decompress(blocks, codec, workers=None):
+    """Uncompress blocks on a thread pool."""
+    if not codec.id:
+        return [bytes(block) for block in blocks]
+    return thread_map(codec.decompress, blocks, workers=workers)
@@ -3,20 +3,40 @@ import zlib
 
 import numpy as np
 
-from .binary import packbits, unpackbits
+from .binary import BitStream, packbits, unpackbits
+from .compression import CODECS
+from .container import TRAILER_SIZE, block_field, block_size_from_field
 
 
-# Maximum header length: 2121 bits
-# data_len: 5 + 32, lsb: 3, fname_len: 8, fname: 255 * 8, compress: 1, crc: 32
-MAX_LENGTH = 2121
+# Maximum header length: 2189 bits
+# marker: 5, version: 4, data_len: 5 + 31, lsb: 3, fname_len: 8, fname: 255 * 8,
+# codec: 4, channels: 4, block size: 4, shard: 1 + 8 + 8 + 32, crc: 32
+MAX_LENGTH = 2189
+# Unversioned headers start with the 5-bit width of `data_len`, which is never
+# zero. A zero width marks a versioned header and is followed by the version.
+# 0: unversioned, the pixel indices are permuted with the 'shuffle' scheme
+# 1: the pixel indices are permuted with the 'feistel' scheme
+# 2: adds the channels which the secret is embedded in
+# 3: replaces the compression bit with the 4-bit id of the compression codec
+# 4: adds the block size of the block container (see `utils.container`)
+# 5: adds a shard flag, which is followed by the shard index and count and the
+#    CRC-32 of the whole secret if set
+VERSION = 5
+# Maximum number of covers a secret can be split across
+MAX_SHARDS = 256
+# The width of the data length is a 5-bit field, so it has at most 31 bits
+MAX_DATA_LEN = 2**31 - 1
 
 def _message_length_from_bits(bits):
     header_len = packbits(bits[:5])
     data_len = packbits(bits[5:5+header_len])
     return data_len, header_len + 5
 
-def _message_length_to_bits(length, bits=32):
-    length_binary = unpackbits(length)
+def _message_length_to_bits(length, width=None):
+    if not 0 <= length <= MAX_DATA_LEN:
+        raise ValueError(f'Secret length must be within [0, {MAX_DATA_LEN:,}] bytes, '
+                         f'but got {length:,}')
+    length_binary = unpackbits(length, width)
     length_header = unpackbits(len(length_binary), 5)
     return np.concatenate([length_header, length_binary])
 
@@ -33,53 +53,190 @@ def decode(bits):
     -------
     out : dict
         Necessary information to extract the secret.
+        - 'version': The header version. 0 for unversioned headers.
         - 'data_len': Bytestream length of the secret.
         - 'lsb': The number of LSBs it has been embedded into.
         - 'fname': The original filename of the secret.
         - 'compress': Whether the secret has been compressed before embedding.
                       In this case 'data_len' refers to the compressed length.
+        - 'codec': The name of the compression codec, or None if the id isn't
+                   registered in `utils.compression.CODECS`. Headers before
+                   version 3 use either 'store' or 'zlib-9'.
+        - 'channels': Tuple of the color channels the secret has been embedded
+                      in, or None for the default embedding plane.
+        - 'block_size': The block size of the block container, or None for a
+                        plain payload.
+        - 'shard': The index of the shard of a secret which has been split
+                   across several covers, or None.
+        - 'shards': The number of shards of the secret, or None.
+        - 'secret_crc': CRC-32 value of the whole compressed secret of a
+                        shard, which verifies its reassembly, or None.
         - 'crc': CRC-32 value for validation. If the secret has been compressed,
                  the checksum value is calculated for the compressed bytestream.
+                 For a block container, it's calculated for its index.
     """ 
-    data_len, index = _message_length_from_bits(bits)
+    version, index = 0, 0
+    if packbits(bits[:5]) == 0:
+        version = packbits(bits[5:9])
+        index = 9
+    data_len, length = _message_length_from_bits(bits[index:])
+    index += length
     lsb = packbits(bits[index:index+3]) + 1
     index += 3
     fname_len = packbits(bits[index:index+8])
     index += 8
-    fname = ''.join(map(chr, np.packbits(bits[index:index+8*fname_len], bitorder='little')))
+    fname = ''.join(map(chr, BitStream.from_groups(bits[index:index+8*fname_len], 1).data))
     index += 8 * fname_len
-    compress = bool(bits[index])
-    index += 1
+    if version >= 3:
+        codec_id = packbits(bits[index:index+4])
+        index += 4
+    else:
+        codec_id = int(bits[index])
+        index += 1
+    codec = next((c.name for c in CODECS.values() if c.id == codec_id), None)
+    channels = None
+    if version >= 2:
+        mask = packbits(bits[index:index+4])
+        channels = tuple(c for c in range(4) if mask >> c & 1) or None
+        index += 4
+    block_size = None
+    if version >= 4:
+        block_size = block_size_from_field(packbits(bits[index:index+4]))
+        index += 4
+    shard = shards = secret_crc = None
+    if version >= 5:
+        if bits[index]:
+            shard = packbits(bits[index+1:index+9])
+            shards = packbits(bits[index+9:index+17]) + 1
+            secret_crc = packbits(bits[index+17:index+49])
+            index += 48
+        index += 1
     crc = packbits(bits[index:index+32])
     index += 32
-    return {'data_len': data_len, 'lsb': lsb, 'fname': fname,
-            'compress': compress, 'crc': crc, 'header_len': index}
+    return {'version': version, 'data_len': data_len, 'lsb': lsb, 'fname': fname,
+            'compress': codec_id != 0, 'codec': codec, 'channels': channels,
+            'block_size': block_size, 'shard': shard, 'shards': shards,
+            'secret_crc': secret_crc, 'crc': crc, 'header_len': index}
     
-def encode(data, fname, lsb, compress):
+def encode(data, fname, lsb, codec, channels=None, version=VERSION):
     """
     Encode the necessary secret information for proper extraction later on.
 
     Parameters
     ----------
     data : bytes
-        The bytestream of the secret.
+        The bytestream of the secret. The rest of the parameters are described
+        in `encode_fields`.
+
+    Returns
+    -------
+    ndarray, uint8 type
+        1-D array of 1s and 0s.
+    """
+    return encode_fields(len(data), zlib.crc32(data), fname, lsb, codec, channels, version)
+
+def encode_fields(data_len, crc, fname, lsb, codec, channels=None, version=VERSION,
+                  fixed=False, block_size=None, shard=None):
+    """
+    Encode the header from the length and checksum of the secret.
+
+    This allows the header of a secret to be encoded without holding the whole
+    secret in memory, e.g., when it's embedded in chunks.
+
+    Parameters
+    ----------
+    data_len : int
+        The bytestream length of the secret.
+    crc : int
+        CRC-32 value of the secret bytestream.
     fname : str
         The filename of the secret.
     lsb : int
         The number of LSBs used for embedding.
-    compress : bool
-        Whether the secret has been compressed.
+    codec : str
+        The name of the compression codec. Headers before version 3 only
+        support 'store' and 'zlib-9'.
+    channels : None or iterable of int, optional
+        The color channels in the range [0, 3] the secret is embedded in. If not
+        defined, the default embedding plane is assumed. Default is None.
+    version : int, optional
+        The header version. Default is the latest version.
+    fixed : bool, optional
+        Encode `data_len` with the maximum width of 31 bits, so that the header
+        length doesn't depend on it and can be reserved before `data_len` is
+        known. Default is False.
+    block_size : None or int, optional
+        The block size if the secret is a block container, whose index is
+        checksummed by `crc`. Headers before version 4 don't support it.
+        Default is None.
+    shard : None or tuple of int, optional
+        The (index, count, secret_crc) of the shard if the secret has been
+        split across several covers, in which case `data_len` and `crc` refer
+        to this shard and `secret_crc` to the whole compressed secret. Headers
+        before version 5 don't support it. Default is None.
 
     Returns
     -------
     ndarray, uint8 type
         1-D array of 1s and 0s.
     """
-    data_len = _message_length_to_bits(len(data))
+    versioned = [np.zeros((5,), dtype=np.uint8), unpackbits(version, 4)] if version else []
+    data_len = _message_length_to_bits(data_len, 31 if fixed else None)
     lsb_bin = unpackbits(lsb-1, 3)
     _, fname = os.path.split(fname)
     fname_len = unpackbits(len(fname), 8)
-    fname_bin = np.unpackbits(np.array(list(fname.encode()), dtype=np.uint8), bitorder='little')
-    compress_bin = np.array([bool(compress)], dtype=np.uint8)
-    crc = unpackbits(zlib.crc32(data), 32)
-    return np.concatenate([data_len, lsb_bin, fname_len, fname_bin, compress_bin, crc])
+    fname_bin = BitStream(fname.encode()).groups(1)
+    codec_id = CODECS[codec].id
+    if version >= 3:
+        codec_bin = unpackbits(codec_id, 4)
+    elif codec_id > 1:
+        raise ValueError(f'Header version {version} does not support the "{codec}" codec')
+    else:
+        codec_bin = np.array([codec_id], dtype=np.uint8)
+    channels_bin = [unpackbits(sum(1 << c for c in channels or ()), 4)] if version >= 2 else []
+    if version >= 4:
+        block_bin = [unpackbits(block_field(block_size), 4)]
+    elif block_size is not None:
+        raise ValueError(f'Header version {version} does not support block containers')
+    else:
+        block_bin = []
+    if version >= 5 and shard is not None:
+        index, count, secret_crc = shard
+        if not 0 <= index < count <= MAX_SHARDS:
+            raise ValueError(f'Shard must be within [0, {count-1}] of at most {MAX_SHARDS} '
+                             f'shards, but got {index} of {count}')
+        shard_bin = [np.ones((1,), dtype=np.uint8), unpackbits(index, 8), unpackbits(count-1, 8),
+                     unpackbits(secret_crc, 32)]
+    elif version >= 5:
+        shard_bin = [np.zeros((1,), dtype=np.uint8)]
+    elif shard is not None:
+        raise ValueError(f'Header version {version} does not support shards')
+    else:
+        shard_bin = []
+    crc = unpackbits(crc, 32)
+    return np.concatenate(versioned + [data_len, lsb_bin, fname_len, fname_bin, codec_bin]
+                          + channels_bin + block_bin + shard_bin + [crc])
+
+def plausible(header, pixels, have=4):
+    """
+    Check a decoded header describes a payload which fits in `pixels` with
+    `have` color channels, and has a valid filename.
+    """
+    if header['version'] > VERSION or header['codec'] is None:
+        return False
+    if header['channels'] and max(header['channels']) >= have:
+        return False
+    if header['shards'] and header['shard'] >= header['shards']:
+        return False
+    if header['block_size'] and header['data_len'] < TRAILER_SIZE:
+        # Shorter than the trailer of the block index
+        return False
+    try:
+        fname = header['fname'].encode('latin-1').decode()
+    except UnicodeError:
+        return False
+    if not fname.isprintable() or fname != os.path.basename(fname):
+        return False
+    bitlength = -(-header['data_len'] * 8 // header['lsb'])
+    channels = len(header['channels']) if header['channels'] else 1
+    return header['header_len'] + -(-bitlength // channels) <= pixels
@@ -1,9 +1,232 @@
+import collections
 import hashlib
+import threading
 
 import numpy as np
 
 
-def permute_indices(shape, passwd='', length=None):
+# Permutation schemes. `SHUFFLE` is the original scheme, which shuffles all
+# pixel indices with numpy's PRNG and is kept to extract older stego files.
+# `FEISTEL` is a keyed Feistel network which computes the permuted position of
+# each index independently, so any range of the sequence can be generated in
+# time and memory proportional to its length.
+SHUFFLE = 'shuffle'
+FEISTEL = 'feistel'
+ROUNDS = 6
+# The permutation is computed in chunks so that the temporaries of each round
+# stay in the CPU cache.
+CHUNK = 2**16
+
+# Memory budget of the default permutation cache in bytes
+CACHE_BYTES = 256 * 2**20
+
+# Shifts and multipliers of the MurmurHash3 finalisers, which are used as the
+# round function of the Feistel network.
+_FMIX = {
+    np.uint32: (16, 0x85ebca6b, 13, 0xc2b2ae35, 16),
+    np.uint64: (33, 0xff51afd7ed558ccd, 33, 0xc4ceb9fe1a85ec53, 33),
+}
+
+def _fmix(x, temp):
+    """Scramble unsigned integers in place."""
+    s1, m1, s2, m2, s3 = _FMIX[x.dtype.type]
+    np.right_shift(x, s1, out=temp)
+    x ^= temp
+    x *= x.dtype.type(m1)
+    np.right_shift(x, s2, out=temp)
+    x ^= temp
+    x *= x.dtype.type(m2)
+    np.right_shift(x, s3, out=temp)
+    x ^= temp
+    return x
+
+def _feistel(x, keys, half):
+    """Encrypt each value of `x` in the domain [0, 2**(2*half))."""
+    dtype = x.dtype.type
+    mask = dtype((1 << half) - 1)
+    left, right = x >> dtype(half), x & mask
+    f, temp = np.empty_like(x), np.empty_like(x)
+    for key in keys:
+        np.bitwise_xor(right, key, out=f)
+        _fmix(f, temp)
+        f &= mask
+        left ^= f
+        left, right = right, left
+    left <<= dtype(half)
+    left |= right
+    return left
+
+def _round_keys(passwd, dtype):
+    digest = hashlib.sha512(passwd.encode()).digest()
+    keys = np.frombuffer(digest, dtype=np.dtype(dtype).newbyteorder('<'))
+    return keys[:ROUNDS].astype(dtype)
+
+def keyed_permutation(n, passwd, start=0, stop=None):
+    """
+    Compute a slice of a keyed pseudo-random permutation of [0, n).
+
+    The Feistel network permutes the smallest domain of an even number of bits
+    that covers `n`, which is at most 4 times larger. Values which fall out of
+    range are encrypted again (cycle walking) until they land within [0, n),
+    which keeps the mapping a permutation.
+
+    Parameters
+    ----------
+    n : int
+        Size of the permuted domain.
+    passwd : str
+        Key of the permutation.
+    start : int, optional
+        First position of the permuted sequence to output. Default is 0.
+    stop : None or int, optional
+        Position where the output stops. If not defined, the sequence is output
+        until its end. Default is None.
+
+    Returns
+    -------
+    out : ndarray, uint32 or uint64 type
+        The permuted values at positions [start, stop). The type is uint32 if
+        `n` does not exceed 2**32.
+
+    Examples
+    --------
+    >>> keyed_permutation(10, 'hello world')
+    array([1, 6, 5, 3, 9, 8, 7, 0, 2, 4], dtype=uint32)
+    >>> keyed_permutation(10, 'hello world', 3, 6)
+    array([3, 9, 8], dtype=uint32)
+    """
+    stop = n if stop is None else min(stop, n)
+    half = max(1, (int(n - 1).bit_length() + 1) // 2)
+    dtype = np.uint32 if half <= 16 else np.uint64
+    keys = _round_keys(passwd, dtype)
+    out = np.empty(max(stop - start, 0), dtype=dtype)
+    for i in range(start, stop, CHUNK):
+        j = min(i + CHUNK, stop)
+        chunk = _feistel(np.arange(i, j, dtype=dtype), keys, half)
+        walk = np.flatnonzero(chunk >= n)
+        while walk.size:
+            chunk[walk] = _feistel(chunk[walk], keys, half)
+            walk = walk[chunk[walk] >= n]
+        out[i-start:j-start] = chunk
+    return out
+
+def _permutation(n, passwd, scheme, start, stop):
+    """Positions [start, stop) of the permutation of [0, n) with a scheme."""
+    dtype = np.uint32 if n <= 2**32 else np.uint64
+    if scheme == FEISTEL:
+        return keyed_permutation(n, passwd, start, stop).astype(dtype, copy=False)
+    # We can't rely on `hash(passwd)` in Python 3, because it returns a
+    # different value for each run
+    seed = int(hashlib.sha256(passwd.encode()).hexdigest(), 16) & 0xffffffff
+    rng = np.random.default_rng(seed)
+    idx = np.arange(n)
+    rng.shuffle(idx)
+    return idx[start:stop].astype(dtype)
+
+class PermutationCache:
+    """
+    Memory-budgeted LRU cache of permuted pixel indices.
+
+    The entries are keyed by the number of pixels, the SHA-256 digest of the
+    password and the scheme, so the passwords themselves are not kept. Each
+    entry is a read-only uint32 array (uint64 for more than 2**32 pixels) of
+    the first positions of the permutation, and requests are served as views
+    of it. The 'shuffle' scheme has to permute all the indices anyway, so its
+    entries are whole permutations. 'feistel' entries are extended on demand,
+    to at least double their length, so that a few small requests don't
+    compute the whole permutation. A 'feistel' request which starts past the
+    end of its entry, or whose entry would exceed the budget, is permuted on
+    its own without caching, so its cost stays proportional to its length.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory budget of all entries. The least recently used entries are
+        evicted to stay within it, and a permutation larger than the budget is
+        not cached. Default is `CACHE_BYTES`.
+
+    Attributes
+    ----------
+    hits, misses, evictions : int
+        Counters of the requests served from the cache, the requests which had
+        to permute indices, and the entries evicted to stay within budget.
+    nbytes : int
+        Memory used by all entries.
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, n, passwd, scheme, start, stop):
+        """Positions [start, stop) of the permutation of [0, n)."""
+        key = (n, hashlib.sha256(passwd.encode()).digest(), scheme)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and stop <= len(entry):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[start:stop]
+            self.misses += 1
+        have = 0 if entry is None else len(entry)
+        size = n if scheme == SHUFFLE else min(n, max(stop, 2 * have))
+        itemsize = 4 if n <= 2**32 else 8
+        if scheme == FEISTEL and (start > have or size * itemsize > self.max_bytes):
+            # Extending the entry would permute all the positions before
+            # `start`, or it wouldn't be kept anyway
+            return _permutation(n, passwd, scheme, start, stop)
+        extension = _permutation(n, passwd, scheme, have, size)
+        entry = extension if entry is None else np.concatenate([entry, extension])
+        entry.flags.writeable = False
+        self._put(key, entry)
+        return entry[start:stop]
+
+    def peek(self, n, passwd, scheme, start, stop):
+        """
+        Positions [start, stop) of the permutation of [0, n) if they are
+        cached, otherwise None. Nothing is permuted, so this is cheap enough
+        to try before permuting parts of the sequence on several threads.
+        """
+        key = (n, hashlib.sha256(passwd.encode()).digest(), scheme)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or stop > len(entry):
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[start:stop]
+
+    def _put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        """Counters and memory use of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'nbytes': self.nbytes}
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+CACHE = PermutationCache()
+
+def permute_indices(shape, passwd='', length=None, start=0, scheme=FEISTEL, cache=CACHE):
     """
     Shuffle the indices of a 2D array.
 
@@ -17,13 +240,26 @@ def permute_indices(shape, passwd='', length=None):
         order. Default is empty string.
     length : None or int, optional
         The number of pixel coordinates to output. If not defined, all pixels
-        will be returned. Default is None.
+        from `start` onwards will be returned. Default is None.
+    start : int, optional
+        Position in the permuted sequence of the first pixel coordinate to
+        output. Default is 0.
+    scheme : {'feistel', 'shuffle'}, optional
+        The permutation scheme. The 'feistel' scheme only computes the requested
+        range, while 'shuffle' has to shuffle all the indices of the image and
+        is only meant for extracting older stego files. Default is 'feistel'.
+    cache : None or PermutationCache, optional
+        Cache of the permuted indices, so that repeated calls for the same
+        image size and password don't permute them again. If None, nothing is
+        cached. Default is the module's `CACHE`.
 
     Returns
     -------
-    out : tuple of ndarrays
-        A tuple containing the rows and the columns of the permuted image
-        pixels. The format is to be directly used for numpy array indexing.
+    out : ndarray, uint32 or uint64 type
+        The flat indices of the permuted image pixels, to be used for indexing
+        the flattened image, e.g., `a.reshape(-1)[idx]`. The type is uint32 if
+        the image does not have more than 2**32 pixels. The array is read-only
+        if it's returned from the cache.
 
     Examples
     --------
@@ -34,26 +270,27 @@ def permute_indices(shape, passwd='', length=None):
             dtype=np.uint8)
     >>> idx = permute_indices(a.shape)
     >>> idx
-    (array([0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2], dtype=int32),
-    array([0, 1, 2, 3, 0, 1, 2, 3, 0, 1, 2, 3], dtype=int32))
-    >>> a[idx]
+    array([ 0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11], dtype=uint32)
+    >>> a.reshape(-1)[idx]
     array([156, 234, 128, 202,  72, 125,  58, 111,  99, 198,  24, 201],
           dtype=uint8)
     >>> idx = permute_indices(a.shape, 'hello world', 7)
-    >>> a[idx]
-    array([202, 198, 201, 111,  72,  58, 125], dtype=uint8)
+    >>> a.reshape(-1)[idx]
+    array([234,  58,  24, 202, 201,  99, 111], dtype=uint8)
+    >>> idx = permute_indices(a.shape, 'hello world', 3, start=4)
+    >>> a.reshape(-1)[idx]
+    array([201,  99, 111], dtype=uint8)
     """
-    # Creating a 1D array for all indices, shuffling it and converting it to 2D
-    # coordinates with div and mod is significantly faster than shuffling tuples
-    # of coordinates from `itertools.product` and zipping that to (all x, all y)
-    # for numpy indexing.
-    idx = np.arange(np.prod(shape))
-    length = length if length is not None else len(idx)
-    if passwd != '':
-        # We can't rely on `hash(passwd)` in Python 3, because it returns a
-        # different value for each run
-        seed = int(hashlib.sha256(passwd.encode()).hexdigest(), 16) & 0xffffffff
-        rng = np.random.default_rng(seed)
-        rng.shuffle(idx)
-    idx = idx[:length]
-    return idx // shape[1], idx % shape[1]
+    # Working with 1D indices is significantly faster than shuffling tuples of
+    # coordinates from `itertools.product` and zipping that to (all x, all y)
+    # for numpy indexing. Flat indices also take a quarter of the memory of
+    # int64 (row, column) pairs.
+    n = int(np.prod(shape))
+    stop = n if length is None else min(start + length, n)
+    if passwd == '':
+        return np.arange(start, stop, dtype=np.uint32 if n <= 2**32 else np.uint64)
+    if scheme not in (FEISTEL, SHUFFLE):
+        raise ValueError(f'Unknown permutation scheme "{scheme}"')
+    if cache is None:
+        return _permutation(n, passwd, scheme, start, stop)
+    return cache.get(n, passwd, scheme, start, stop)
@@ -1,6 +1,35 @@
+import io
+import mmap
+import os.path
+import shutil
+
 import numpy as np
 from PIL import Image
 
+from .parallel import thread_map
+from .validation import frames_format
+
+
+# Image modes whose raw pixel data can be memory-mapped as uint8
+MAPPABLE_MODES = {'L': 1, 'RGB': 3, 'RGBA': 4}
+NPY_MAGIC = b'\x93NUMPY'
+# Keyword arguments of `PIL.Image.save` for each save profile and format.
+# 'fast' and 'fastest' trade file size for encoding speed, e.g., for
+# intermediate files of a pipeline, and 'small' does the opposite. WebP is
+# always saved lossless, as lossy formats destroy the secret.
+SAVE_PROFILES = {
+    'default': {'WEBP': {'lossless': True}},
+    'fast': {'PNG': {'compress_level': 1, 'optimize': False},
+             'TIFF': {'compression': 'raw'},
+             'WEBP': {'lossless': True, 'method': 0}},
+    'fastest': {'PNG': {'compress_level': 0, 'optimize': False},
+                'TIFF': {'compression': 'raw'},
+                'WEBP': {'lossless': True, 'method': 0}},
+    'small': {'PNG': {'compress_level': 9, 'optimize': True},
+              'TIFF': {'compression': 'tiff_adobe_deflate'},
+              'WEBP': {'lossless': True, 'quality': 100}},
+}
+
 
 def fread(fname):
     """Read bytestream from file."""
@@ -12,15 +41,277 @@ def fsave(bytestream, fname):
     """Save bytestream to file."""
     with open(fname, 'wb') as f:
         f.write(bytestream)
-    
-def imread(fname, mode=None):
-    """Read pixel array from file."""
+
+def fmap(fname):
+    """
+    Memory-map a file read-only as a bytes-like object, so that only the parts
+    which are accessed are read, e.g., samples of a large secret.
+    """
+    with open(fname, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _is_npy(fname):
+    """Check a path has the .npy extension, or a file object starts with the .npy magic."""
+    if hasattr(fname, 'read'):
+        position = fname.tell()
+        magic = fname.read(len(NPY_MAGIC))
+        fname.seek(position)
+        return magic == NPY_MAGIC
+    return os.path.splitext(fname)[1].lower() == '.npy'
+
+def imread(fname, mode=None, writable=True, frames=False, workers=None):
+    """
+    Read pixel array from file or file object.
+
+    .npy files are loaded with numpy, and the pixel data of uncompressed
+    images, e.g., TIFF or PPM/PGM, is read straight to the array without
+    decoding. Other images are decoded with PIL, which has to make a copy to
+    return a writable array. If `writable` is False, the array may be
+    read-only to avoid that copy.
+
+    If `frames` is True, all the frames of a multi-frame image, e.g., an
+    animated PNG or GIF, or a multi-page TIFF, are read to an array of shape
+    (frames, height, width[, channels]), which has a single frame for other
+    images. The pages of a TIFF file are decoded on the shared thread pool of
+    `utils.parallel`, with at most `workers` at a time, or as many as the
+    CPUs.
+    """
+    if frames:
+        return _read_frames(fname, mode, writable, workers)
+    if _is_npy(fname):
+        array = np.load(fname)
+        return np.array(Image.fromarray(array).convert(mode)) if mode else array
     img = Image.open(fname)
-    if mode:
-        img = img.convert(mode)
-    return np.array(img)
+    if mode and img.mode != mode:
+        return np.array(img.convert(mode))
+    if isinstance(fname, (str, os.PathLike)):
+        try:
+            offset, shape = _raw_layout(img)
+        except ValueError:
+            pass
+        else:
+            img.close()
+            return np.fromfile(fname, dtype=np.uint8, count=int(np.prod(shape)),
+                               offset=offset).reshape(shape)
+    return np.array(img) if writable else np.asarray(img)
+
+def imshape(fname, frames=False):
+    """
+    Shape of the pixel array of an image file, which is read from the file
+    header without decoding the pixels. `frames` is described in `imread`.
+    """
+    if _is_npy(fname):
+        shape = np.load(fname, mmap_mode='r').shape
+        return (1,) + shape if frames else shape
+    with Image.open(fname) as img:
+        width, height = img.size
+        n = getattr(img, 'n_frames', 1) if frames else 1
+        modes = []
+        for i in range(n):
+            img.seek(i)
+            modes.append((img.mode, 'transparency' in img.info))
+        bands = Image.getmodebands(_common_mode(modes))
+    shape = (height, width) if bands == 1 else (height, width, bands)
+    return (n,) + shape if frames else shape
+
+def _common_mode(modes):
+    """
+    The mode which (mode, transparency) pairs of frames are converted to: the
+    mode of all the frames, or else RGB, or RGBA if any frame has transparency.
+    """
+    if len({mode for mode, _ in modes}) == 1:
+        return modes[0][0]
+    return 'RGBA' if any('A' in mode or alpha for mode, alpha in modes) else 'RGB'
+
+def _read_frame(fname, i):
+    """Decode a frame of an image file with random access to its frames."""
+    with Image.open(fname) as img:
+        img.seek(i)
+        img.load()
+        return img.copy()
+
+def _read_frames(fname, mode=None, writable=True, workers=None):
+    """
+    Read all the frames of an image to a (frames, height, width[, channels])
+    array.
 
-def imsave(array, fname):
-    """Save pixel array to file."""
+    Frames of different modes, e.g., the palette and RGB frames of a GIF, are
+    converted to RGB, or RGBA if any frame has transparency.
+    """
+    position = fname.tell() if hasattr(fname, 'read') else None
+    if not _is_npy(fname):
+        with Image.open(fname) as img:
+            n = getattr(img, 'n_frames', 1)
+            if n > 1 and img.format == 'TIFF' and position is None:
+                images = thread_map(_read_frame, [fname] * n, range(n), workers=workers)
+            elif n > 1:
+                images = []
+                for i in range(n):
+                    img.seek(i)
+                    images.append(img.copy())
+        if n > 1:
+            mode = mode or _common_mode([(img.mode, 'transparency' in img.info)
+                                         for img in images])
+            return np.stack([np.asarray(img.convert(mode) if mode and img.mode != mode else img)
+                             for img in images])
+        if position is not None:
+            fname.seek(position)
+    return imread(fname, mode, writable)[None]
+
+def _format(fmt):
+    """PIL format name of a format or extension, e.g., 'TIFF' for 'tif'."""
+    return Image.registered_extensions().get(f'.{fmt.lower()}', fmt.upper())
+
+def save_params(fmt, profile='default', **params):
+    """
+    Keyword arguments of `PIL.Image.save` for an image format, e.g., 'png' or
+    'tif', from a save profile of `SAVE_PROFILES`, updated with `params`.
+    """
+    if profile not in SAVE_PROFILES:
+        raise ValueError(f'Unknown save profile "{profile}"')
+    return {**SAVE_PROFILES[profile].get(_format(fmt), {}), **params}
+
+def imsave(array, fname, profile='default', frames=False, **params):
+    """
+    Save pixel array to file.
+
+    .npy files are saved with numpy, and images with the keyword arguments of
+    `save_params`. If `frames` is True, the array holds frames as read by
+    `imread`, and several frames are saved in one pass as an animated PNG or a
+    multi-page TIFF.
+    """
+    if frames and len(array) > 1:
+        frames_format(fname, len(array))
+        images = [Image.fromarray(frame) for frame in array]
+        images[0].save(fname, save_all=True, append_images=images[1:],
+                       **save_params(os.path.splitext(fname)[1][1:], profile, **params))
+        return
+    if frames:
+        array = array[0]
+    if _is_npy(fname):
+        np.save(fname, array)
+        return
     img = Image.fromarray(array)
-    img.save(fname)
+    img.save(fname, **save_params(os.path.splitext(fname)[1][1:], profile, **params))
+
+def imdecode(data, mode=None, writable=True, frames=False):
+    """
+    Read pixel array from an encoded image bytestream or file object.
+
+    If `writable` is False, the pixel data of uncompressed images is viewed in
+    the bytestream without copying. `frames` is described in `imread`.
+    """
+    if hasattr(data, 'read'):
+        return imread(data, mode, writable, frames)
+    if frames:
+        if bytes(data[:len(NPY_MAGIC)]) != NPY_MAGIC:
+            with Image.open(io.BytesIO(data)) as img:
+                if getattr(img, 'n_frames', 1) > 1:
+                    return _read_frames(io.BytesIO(data), mode, writable)
+        return imdecode(data, mode, writable)[None]
+    if not writable and not mode and bytes(data[:len(NPY_MAGIC)]) != NPY_MAGIC:
+        try:
+            offset, shape = _raw_layout(Image.open(io.BytesIO(data)))
+        except ValueError:
+            pass
+        else:
+            return np.frombuffer(data, dtype=np.uint8, count=int(np.prod(shape)),
+                                 offset=offset).reshape(shape)
+    return imread(io.BytesIO(data), mode, writable)
+
+def imencode(array, fmt='png', profile='default', frames=False, **params):
+    """
+    Encode pixel array to an image bytestream of the given format, with the
+    keyword arguments of `save_params`. The 'npy' format is saved with numpy.
+    `frames` is described in `imsave`.
+    """
+    f = io.BytesIO()
+    if frames and len(array) > 1:
+        frames_format(f'stego.{fmt}', len(array))
+        images = [Image.fromarray(frame) for frame in array]
+        images[0].save(f, format=_format(fmt), save_all=True, append_images=images[1:],
+                       **save_params(fmt, profile, **params))
+        return f.getvalue()
+    if frames:
+        array = array[0]
+    if fmt.lower() == 'npy':
+        np.save(f, array)
+    else:
+        img = Image.fromarray(array)
+        img.save(f, format=_format(fmt), **save_params(fmt, profile, **params))
+    return f.getvalue()
+
+def _raw_layout(img):
+    """
+    Find the offset and shape of the pixel data of an uncompressed image.
+
+    The pixel data can be memory-mapped if PIL decodes it with the raw codec,
+    as one or more top-down strips which are contiguous in the file.
+    """
+    if img.mode not in MAPPABLE_MODES:
+        raise ValueError(f'Mode {img.mode} can not be memory-mapped')
+    width, height = img.size
+    channels = MAPPABLE_MODES[img.mode]
+    offset = img.tile[0].offset if img.tile else 0
+    expected = offset
+    for tile in sorted(img.tile, key=lambda t: t.offset):
+        args = (tile.args,) if isinstance(tile.args, str) else tuple(tile.args)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        x0, y0, x1, y1 = tile.extents
+        if (tile.codec_name != 'raw' or rawmode != img.mode
+                or stride not in (0, width * channels) or orientation != 1
+                or (x0, x1) != (0, width) or tile.offset != expected
+                or tile.offset != offset + y0 * width * channels):
+            raise ValueError(f'Pixel data of "{img.filename}" can not be memory-mapped')
+        expected += (y1 - y0) * width * channels
+    if expected != offset + height * width * channels:
+        raise ValueError(f'Pixel data of "{img.filename}" can not be memory-mapped')
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    return offset, shape
+
+def immap(fname, mode='r', source=None):
+    """
+    Memory-map the pixel array of an uncompressed image file.
+
+    Only the pixels which are accessed are read from the file, and with mode
+    'r+' only the pixels which are modified are written back to it. This works
+    for .npy files of uint8 type, and for image files with raw pixel data in
+    L, RGB or RGBA mode, such as uncompressed TIFF and binary PGM/PPM. Images
+    of several frames, e.g., multi-page TIFF, can't be memory-mapped, since
+    their frames aren't contiguous in the file.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the image file.
+    mode : {'r', 'r+'}, optional
+        Read-only or read-write access. Default is 'r'.
+    source : None or str, optional
+        If set, this image file is first copied to `fname`. The copy is done
+        by the file system without decoding the pixels. Default is None.
+
+    Returns
+    -------
+    numpy.memmap
+        The pixel array backed by the file. Call `flush` to make sure that any
+        modifications are written to disk.
+    """
+    copy = source is not None and os.path.abspath(source) != os.path.abspath(fname)
+    if os.path.splitext(fname)[1].lower() == '.npy':
+        if copy:
+            shutil.copyfile(source, fname)
+        array = np.load(fname, mmap_mode=mode)
+        if array.dtype != np.uint8 or not array.flags.c_contiguous:
+            raise ValueError(f'"{fname}" must be a C-contiguous array of uint8 type')
+        return array
+    # The layout is checked before copying, so nothing is written on failure
+    with Image.open(source if copy else fname) as img:
+        if getattr(img, 'n_frames', 1) > 1:
+            raise ValueError(f'"{img.filename}" has {img.n_frames} frames, but only images of '
+                             f'a single frame can be memory-mapped')
+        offset, shape = _raw_layout(img)
+    if copy:
+        shutil.copyfile(source, fname)
+    return np.memmap(fname, dtype=np.uint8, mode=mode, offset=offset, shape=shape)
@@ -0,0 +1,130 @@
+import contextlib
+import os
+import threading
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# The bit packing and substitution kernels are chains of numpy operations,
+# each of which allocates a full-size temporary. With numba installed, they
+# are fused into single loops over the output, which run in parallel on large
+# arrays. The backend is 'numba' if it's installed, unless the LSB_BACKEND
+# environment variable is 'numpy'. Both backends produce identical output,
+# which tests/test_kernels.py checks.
+BACKENDS = ('numpy', 'numba')
+# Arrays of fewer elements are processed serially, since starting the threads
+# takes longer
+PARALLEL_SIZE = 2**16
+
+def _default_backend():
+    backend = os.environ.get('LSB_BACKEND', 'numba' if numba else 'numpy')
+    if backend not in BACKENDS:
+        raise ValueError(f'LSB_BACKEND must be one of {BACKENDS}, but got {backend!r}')
+    if backend == 'numba' and numba is None:
+        raise ValueError('The numba backend requires the numba package')
+    return backend
+
+backend = _default_backend()
+
+@contextlib.contextmanager
+def use(name):
+    """Switch the backend of the kernels within the enclosed code."""
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f'Backend must be one of {BACKENDS}, but got {name!r}')
+    if name == 'numba' and numba is None:
+        raise ValueError('The numba backend requires the numba package')
+    previous, backend = backend, name
+    try:
+        yield
+    finally:
+        backend = previous
+
+def enabled():
+    """Whether the kernels of this module are used instead of numpy."""
+    return backend == 'numba'
+
+if numba is not None:
+    def _jit(func):
+        """
+        Compile a kernel serially and in parallel. The parallel version is
+        only run from the main thread, because the default threading layer of
+        numba doesn't support concurrent launches from several threads.
+        """
+        serial = numba.njit(cache=True, nogil=True)(func)
+        parallel = numba.njit(cache=True, nogil=True, parallel=True)(func)
+        def kernel(n, *args):
+            if n >= PARALLEL_SIZE and threading.current_thread() is threading.main_thread():
+                return parallel(n, *args)
+            return serial(n, *args)
+        return kernel
+
+    # Every k bytes hold exactly 8 k-bit groups, which fit in a 64-bit word.
+    # Bytes past the end of the data are read as zeroes.
+    @_jit
+    def _groups(n, data, k, first, out):
+        mask = (1 << k) - 1
+        for i in numba.prange(n):
+            base = (first + i) * k
+            word = np.int64(0)
+            for b in range(min(k, len(data) - base)):
+                word |= np.int64(data[base+b]) << (8 * b)
+            for j in range(8):
+                out[8*i+j] = (word >> (j * k)) & mask
+
+    @_jit
+    def _from_groups(n, groups, k, out):
+        mask = (1 << k) - 1
+        for i in numba.prange(n):
+            word = np.int64(0)
+            for j in range(min(8, len(groups) - 8 * i)):
+                word |= (np.int64(groups[8*i+j]) & mask) << (j * k)
+            for b in range(min(k, len(out) - i * k)):
+                out[i*k+b] = (word >> (8 * b)) & 255
+
+    @_jit
+    def _lookup(n, table, original, stream, k, out):
+        mask = (1 << k) - 1
+        for i in numba.prange(n):
+            out[i] = table[(np.int64(original[i]) << k) | (np.int64(stream[i]) & mask)]
+
+def groups(data, k, start, stop):
+    """
+    The k-bit groups [start, stop) of a little-endian bytestream in a single
+    pass, as in `utils.binary.BitStream.groups`.
+    """
+    if start >= stop:
+        return np.empty((0,), dtype=np.uint8)
+    first, last = start // 8, -(-stop // 8)
+    out = np.empty((8 * (last - first),), dtype=np.uint8)
+    _groups(last - first, data, k, first, out)
+    return out[start-8*first:stop-8*first]
+
+def from_groups(groups, k):
+    """
+    Combine k-bit groups to a little-endian bytestream in a single pass, as
+    in `utils.binary.BitStream.from_groups`. Only the k low bits of each
+    group are used.
+    """
+    out = np.empty((-(-len(groups) * k // 8),), dtype=np.uint8)
+    _from_groups(-(-len(groups) // 8), np.ascontiguousarray(groups), k, out)
+    return out
+
+def lookup(table, original, stream, k, out=None):
+    """
+    Look up the stego value of each (original, stream) pair in a single
+    pass, as in `utils.algorithms.lsb_substitute`. Only the k low bits of
+    each stream value are used.
+    """
+    result = out if out is not None and out.flags.c_contiguous else np.empty(original.shape,
+                                                                             dtype=np.uint8)
+    _lookup(original.size, table.reshape(-1), original.reshape(-1), stream.reshape(-1), k,
+            result.reshape(-1))
+    if out is not None and result is not out:
+        out[...] = result
+    return out if out is not None else result
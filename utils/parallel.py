@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+
+# A single pool with a thread per CPU runs everything which is parallelised on
+# threads, e.g., the parts of the payload pixels, the blocks of the container
+# and the blocks of the 'pzlib' codecs, so concurrent jobs share its threads
+# instead of each starting their own. A task which maps on the pool again,
+# e.g., a container block compressed with 'pzlib', runs that map serially
+# instead of waiting on the threads it occupies.
+THREAD_PREFIX = 'lsb-worker'
+
+_pool = None
+_lock = threading.Lock()
+
+def _executor():
+    """The shared thread pool, which is started on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix=THREAD_PREFIX)
+        return _pool
+
+def thread_map(func, *iterables, workers=None):
+    """
+    Call `func` for each item of `iterables` on the shared thread pool.
+
+    The items are split into `workers` interleaved groups, or as many as the
+    CPUs, and the items of each group are called one after the other, so at
+    most `workers` calls run at a time. Calls from a thread of the pool run
+    serially on that thread.
+
+    Returns
+    -------
+    list
+        The results in the order of the items.
+    """
+    items = list(zip(*iterables))
+    n = min(workers or os.cpu_count() or 1, len(items))
+    if n <= 1 or threading.current_thread().name.startswith(THREAD_PREFIX):
+        return [func(*args) for args in items]
+    def run(group):
+        return [func(*args) for args in group]
+    groups = list(_executor().map(run, [items[i::n] for i in range(n)]))
+    return [groups[i % n][i // n] for i in range(len(items))]
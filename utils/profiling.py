@@ -0,0 +1,76 @@
+import contextlib
+import time
+
+
+class Profile:
+    """
+    Duration and bytes processed by each stage of an embedding or extraction.
+
+    Attributes
+    ----------
+    stages : dict
+        For each stage name, a dict with the accumulated 'time' in seconds, the
+        'bytes' processed and the number of 'calls'. Stages which run once per
+        chunk are accumulated over all chunks.
+    info : dict
+        Other results, such as the pixels used or the PSNR.
+
+    Examples
+    --------
+    >>> profile = Profile()
+    >>> with profile.stage('read') as record:
+    ...     secret = fread(fname)
+    ...     record['bytes'] = len(secret)
+    >>> with profile.stage('compression', len(secret)):
+    ...     data = deflate(secret)
+    """
+    def __init__(self):
+        self.stages = {}
+        self.info = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, nbytes=0):
+        """
+        Time the enclosed code as a stage which processes `nbytes`.
+
+        The context manager returns a dict, whose 'bytes' can be updated if
+        they are not known in advance.
+        """
+        record = {'bytes': nbytes}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - start, record['bytes'])
+
+    def add(self, name, elapsed, nbytes=0):
+        """Accumulate the duration and bytes processed of a stage."""
+        stage = self.stages.setdefault(name, {'time': 0., 'bytes': 0, 'calls': 0})
+        stage['time'] += elapsed
+        stage['bytes'] += nbytes
+        stage['calls'] += 1
+
+    def merge(self, other):
+        """
+        Accumulate the stages of another profile, e.g., of a part of the work
+        which ran on another thread. The durations of parts which ran in
+        parallel add up to more than the wall time.
+        """
+        for name, stage in other.stages.items():
+            merged = self.stages.setdefault(name, {'time': 0., 'bytes': 0, 'calls': 0})
+            for field in merged:
+                merged[field] += stage[field]
+
+    def total(self):
+        """Total duration of all stages in seconds."""
+        return sum(stage['time'] for stage in self.stages.values())
+
+    def as_dict(self):
+        """Plain dict of the stages and info, e.g., for JSON serialisation."""
+        return {'stages': self.stages, 'info': self.info}
+
+    def __str__(self):
+        lines = [f'{name:<14} {s["time"]*1e3:10.2f} ms {s["bytes"]:>14,} B {s["calls"]:>6} calls'
+                 for name, s in self.stages.items()]
+        lines.append(f'{"total":<14} {self.total()*1e3:10.2f} ms')
+        return '\n'.join(lines)
@@ -1,13 +1,85 @@
 import numpy as np
 
 
-def mse(a, b):
-    """Mean square error between a modified image and the original."""
-    x, y = a.shape
+def mse(a, b, size=None):
+    """
+    Mean square error between a modified image and the original.
+
+    If `size` is set, `a` and `b` may hold only the modified pixels of an image
+    with `size` pixels in total.
+    """
+    size = a.size if size is None else size
     a = a.astype(np.int32)
-    return np.sum((a - b)**2) / (x * y)
+    return np.sum((a - b)**2) / size
 
-def psnr(a, b, a_max=255):
+def psnr(a, b, a_max=255, size=None):
     """Peak signal-to-noise ratio between a modified image and the original."""
-    e = mse(a, b)
+    return psnr_from_mse(mse(a, b, size), a_max)
+
+def psnr_from_mse(e, a_max=255):
+    """
+    Peak signal-to-noise ratio from the mean square error.
+
+    The mean square error of an image can be accumulated from parts which are
+    modified separately, e.g., `mse(a1, b1, size) + mse(a2, b2, size)`.
+    """
     return 10 * np.log10(a_max**2 / e) if e else np.inf
+
+class Metrics:
+    """
+    Quality metrics of a modified image accumulated from its modified pixels.
+
+    Only the gathered (original, modified) pixel values are passed to
+    `update`, while the unchanged pixels of the image count towards the total
+    `size`. The sum of square errors is accumulated as an exact integer, so
+    the metrics are identical to those computed over the whole image.
+
+    Parameters
+    ----------
+    size : int
+        The number of pixel values of the whole image.
+    a_max : int, optional
+        Maximum pixel value. Default is 255.
+
+    Examples
+    --------
+    >>> metrics = Metrics(cover.size)
+    >>> metrics.update(cover.flat[idx], stego.flat[idx])
+    >>> metrics.psnr == psnr(stego, cover)
+    True
+    """
+    def __init__(self, size, a_max=255):
+        self.size = size
+        self.a_max = a_max
+        self.sse = 0
+        self.changed = 0
+        self.max_error = 0
+        self.histogram_delta = np.zeros(a_max + 1, dtype=np.int64)
+
+    def update(self, original, modified):
+        """Add a vector of original pixel values and their modified values."""
+        original = np.asarray(original).reshape(-1)
+        modified = np.asarray(modified).reshape(-1)
+        if not len(original):
+            return
+        diff = modified.astype(np.int32) - original
+        self.sse += int(np.sum(diff * diff, dtype=np.int64))
+        self.changed += int(np.count_nonzero(diff))
+        self.max_error = max(self.max_error, int(np.abs(diff).max()))
+        self.histogram_delta += np.bincount(modified, minlength=self.a_max + 1)
+        self.histogram_delta -= np.bincount(original, minlength=self.a_max + 1)
+
+    def merge(self, other):
+        """Add the metrics of another part of the same image."""
+        self.sse += other.sse
+        self.changed += other.changed
+        self.max_error = max(self.max_error, other.max_error)
+        self.histogram_delta += other.histogram_delta
+
+    @property
+    def mse(self):
+        return self.sse / self.size
+
+    @property
+    def psnr(self):
+        return float(psnr_from_mse(self.mse, self.a_max))
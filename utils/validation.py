@@ -13,6 +13,31 @@ def file_format(fname):
     if ext[1:].lower() in ('jpg', 'jpeg'):
         raise ValueError(f'Output file must not be in JPEG format')
 
+def frames_format(fname, frames):
+    """Check a filename has a format which stores several frames losslessly."""
+    _, ext = os.path.splitext(fname)
+    if frames > 1 and ext[1:].lower() not in ('png', 'apng', 'tif', 'tiff'):
+        raise ValueError(f'Output file of {frames} frames must be in PNG or TIFF format')
+
+def same_format(fname, other):
+    """Check two filenames have the same extension."""
+    ext1, ext2 = os.path.splitext(fname)[1], os.path.splitext(other)[1]
+    if ext1.lower() != ext2.lower():
+        raise ValueError(f'Output file must have the same format as "{fname}"')
+
+def writable(image):
+    """Check an image can be modified in place through a view of its pixels."""
+    if not image.flags.writeable:
+        raise ValueError('Cover image must be writable, as it is modified in place')
+    if not image.flags.c_contiguous:
+        raise ValueError('Cover image must be a C-contiguous array, as it is modified in place. '
+                         'Pass a copy made with `np.ascontiguousarray`')
+
+def channels(channels, have):
+    """Check the embedding channels exist in the cover image."""
+    if not channels or any(c < 0 or c >= have for c in channels):
+        raise ValueError(f'Channels must be within [0, {have-1}], but got {channels}')
+
 def space_capacity(need, have):
     """Check there are enough pixels in the cover image for embedding."""
     if need > have:
@@ -22,5 +47,9 @@ def space_capacity(need, have):
 
 def data_integrity(data, crc):
     """Check the CRC-32 value is the same to that from the extracted data."""
-    if zlib.crc32(data) != crc:
+    checksum(zlib.crc32(data), crc)
+
+def checksum(value, crc):
+    """Check a running CRC-32 value is the same to the expected one."""
+    if value != crc:
         raise ValueError('Data integrity not verified.')